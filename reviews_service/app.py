@@ -6,6 +6,7 @@ and then returns JSON responses.
 """
 
 import os
+import sqlite3
 import logging
 from flask_talisman import Talisman 
 import jwt
@@ -21,24 +22,33 @@ sentry_sdk.init(
 
 AUTH_SECRET_KEY = os.environ.get("AUTH_SECRET_KEY", "dev-secret-key-change-me")
 
+# JWT decoding is set up once so get_current_user doesn't rebuild it per request
+_jwt_decoder = jwt.PyJWT()
+_ALGS = ("HS256",)
+_DECODE_OPTIONS = {"verify_signature": True, "verify_exp": True, "require": ["exp"]}
+
 # ADDED FOR TASK 7  Custom Exceptions
-class BadRequestError(Exception):
-    pass
+class APIError(Exception):
+    """Base for all API errors, each subclass carries its HTTP status."""
+    status = 500
+
+class BadRequestError(APIError):
+    status = 400
 
-class UnauthorizedError(Exception):
-    pass
+class UnauthorizedError(APIError):
+    status = 401
 
-class ForbiddenError(Exception):
-    pass
+class ForbiddenError(APIError):
+    status = 403
 
-class NotFoundError(Exception):
-    pass
+class NotFoundError(APIError):
+    status = 404
 
-class ConflictError(Exception):
-    pass
+class ConflictError(APIError):
+    status = 409
 
-class InternalServerError(Exception):
-    pass
+class InternalServerError(APIError):
+    status = 500
 
 
 # Support both import styles: for Sphinx and direct run
@@ -104,18 +114,26 @@ if not logger.handlers:
 
 def get_current_user():
     """This fct decode user from token, fallback to X-User-* headers."""
-    auth_header = request.headers.get("Authorization", "")
+    # read straight from the WSGI environ, skips the EnvironHeaders wrapper
+    env = request.environ
+    auth_header = env.get("HTTP_AUTHORIZATION", "")
 
     if auth_header.startswith("Bearer "):
         token = auth_header[7:]
         try:
-            payload = jwt.decode(token, AUTH_SECRET_KEY, algorithms=["HS256"])
+            payload = _jwt_decoder.decode(
+                token,
+                AUTH_SECRET_KEY,
+                algorithms=_ALGS,
+                options=_DECODE_OPTIONS,
+                leeway=0,
+            )
             return payload.get("username"), payload.get("role")
         except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
             return None, None
 
-    username = request.headers.get("X-User-Name")
-    role = request.headers.get("X-User-Role")
+    username = env.get("HTTP_X_USER_NAME")
+    role = env.get("HTTP_X_USER_ROLE")
 
     if not username or not role:
         return None, None
@@ -244,7 +262,7 @@ def list_reviews_for_room(room_id):
         return jsonify({"error": "room not found"}), 404
 
     rows = get_reviews_for_room(room_id)
-    return jsonify([dict(r) for r in rows]), 200
+    return jsonify(rows), 200
 
 
 
@@ -289,12 +307,21 @@ def submit_review_route():
         raise NotFoundError("room not found")
         return jsonify({"error": "room not found"}), 404
 
-    review_id = submit_review(
-        data["user_id"],
-        data["room_id"],
-        int(data["rating"]),
-        data["comment"],
-    )
+    try:
+        review_id = submit_review(
+            data["user_id"],
+            data["room_id"],
+            int(data["rating"]),
+            data["comment"],
+        )
+    except sqlite3.IntegrityError:
+        # user or room deleted by its own service between the check and the
+        # insert (foreign_keys=ON): report whichever one is gone
+        if not find_user_by_id(data["user_id"]):
+            raise NotFoundError("user not found")
+        if not find_room_by_id(data["room_id"]):
+            raise NotFoundError("room not found")
+        raise
 
     if not review_id:
         raise InternalServerError("could not create review")
@@ -388,27 +415,16 @@ def allow_metrics():
 
 # --- Global Error Handlers (pytest-compatible) ---
 
-@app.errorhandler(BadRequestError)
-def handle_bad_request(e):
-    return jsonify({"error": str(e)}), 400
-
-@app.errorhandler(UnauthorizedError)
-def handle_unauthorized(e):
-    return jsonify({"error": str(e)}), 401
-
-@app.errorhandler(ForbiddenError)
-def handle_forbidden(e):
-    return jsonify({"error": str(e)}), 403
-
-@app.errorhandler(NotFoundError)
-def handle_not_found(e):
-    if request.path == "/metrics":
+@app.errorhandler(APIError)
+def handle_api_error(e):
+    """One handler for every APIError subclass, status comes from the class."""
+    if e.status == 404 and request.path == "/metrics":
         return e
-    return jsonify({"error": str(e)}), 404
-
-@app.errorhandler(ConflictError)
-def handle_conflict(e):
-    return jsonify({"error": str(e)}), 409
+    if e.status >= 500:
+        # the detail is for the server log only, clients get the generic body
+        logger.error("API error %s on %s: %s", e.status, request.path, e)
+        return jsonify({"error": "internal server error"}), e.status
+    return jsonify({"error": str(e)}), e.status
 
 @app.errorhandler(Exception)
 def handle_generic_error(e):
@@ -5,71 +5,195 @@ and other db related functions which will be used by app.py.
 """
 import sqlite3
 import os
+import threading
+import queue
+from contextlib import contextmanager
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 DEFAULT_DB_FILE = os.path.join(BASE_DIR, "database.db")
+# may also be a sqlite URI, e.g. "file:reviews?mode=memory&cache=shared"
 DB_FILE = os.environ.get("REVIEWS_DB_PATH", DEFAULT_DB_FILE)
 
+# bound once so opening a connection skips the sqlite3 module attribute lookup
+_connect = sqlite3.connect
+_Row = sqlite3.Row
+
+# journal_mode=WAL is stored in the db file, so it only has to be set once per process
+_wal_applied = False
+
+
+def _apply_pragmas(conn):
+    """apply the PRAGMAs every reviews connection should run with.
+    WAL + synchronous=NORMAL avoid a full fsync per commit, the rest keeps
+    temp tables and hot pages in memory.
+    """
+    global _wal_applied
+    if not _wal_applied:
+        conn.execute("PRAGMA journal_mode=WAL")
+        _wal_applied = True
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-20000")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA foreign_keys=ON")
+
 
 def get_db_connection():
     """open a connection to the reviews database and return it.
     connection uses ``sqlite3.Row`` so we can access columns by name.
     """
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
+    conn = _connect(DB_FILE, uri=True)
+    conn.row_factory = _Row
+    _apply_pragmas(conn)
     return conn
 
 
+def _dict_factory(cursor, row):
+    """row factory that builds plain dicts, ready for jsonify as-is."""
+    return {col[0]: value for col, value in zip(cursor.description, row)}
 
 
-def make_reviews_table_if_missing():
-    """Create the ``reviews`` table if it does not already exist.
-    
-    Takes no parameters.
-
-    Returns
-    None
-        Simply ensures the table exists in the database.
+class ConnectionPool:
+    """small fixed-size pool of reviews connections.
+    connections are opened lazily up to ``size`` and then handed back and
+    forth through a queue, so the helpers never pay connect + PRAGMA setup.
+    with no ``db_file`` each new connection opens the module's current
+    ``DB_FILE``, so overriding it before first use still works.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
 
-    cur.execute(
-        """
-        create table if not exists reviews (
-            id integer primary key autoincrement,
+    def __init__(self, db_file=None, size=8):
+        self.db_file = db_file
+        self.size = size
+        self._queue = queue.Queue(maxsize=size)
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        # autocommit: reads never open a transaction, each single-statement
+        # write commits on its own, multi-statement writes BEGIN explicitly
+        conn = _connect(
+            self.db_file or DB_FILE,
+            check_same_thread=False,
+            cached_statements=256,
+            isolation_level=None,
+            uri=True,
+        )
+        conn.row_factory = _dict_factory
+        _apply_pragmas(conn)
+        return conn
+
+    def get(self):
+        """check a connection out, blocking if all ``size`` are in use."""
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._opened < self.size:
+                    conn = self._open()
+                    self._opened += 1
+                    return conn
+            return self._queue.get()
+
+    def put(self, conn):
+        """give a connection back, dropping anything left uncommitted."""
+        if conn.in_transaction:
+            conn.rollback()
+        self._queue.put(conn)
+
+
+_pool = ConnectionPool()
+
+# every hot query lives here so each call passes the exact same string and
+# hits the connection's prepared-statement cache instead of re-parsing
+_SQL = {
+    "submit": """
+        insert into reviews (user_id, room_id, rating, comment)
+        values (?, ?, ?, ?);
+    """,
+    "update": """
+        update reviews
+        set rating = ?, comment = ?, updated_at = current_timestamp
+        where id = ?;
+    """,
+    "delete": "delete from reviews where id = ?;",
+    "for_room": """
+        select * from reviews
+        where room_id = ?
+        order by created_at desc;
+    """,
+    "flag": """
+        update reviews
+        set flagged = 1, updated_at = current_timestamp
+        where id = ?;
+    """,
+    "review_by_id": "select * from reviews where id = ?;",
+    "user_by_id": "select * from users where id = ?;",
+    "room_by_id": "select * from rooms where id = ?;",
+}
+
+
+@contextmanager
+def get_conn():
+    """borrow a pooled connection for the duration of a ``with`` block."""
+    conn = _pool.get()
+    try:
+        yield conn
+    finally:
+        _pool.put(conn)
+
 
-            -- id of the user which is submitting the review
-            user_id integer not null,
 
-            -- id of the room that is being reviewed
-            room_id integer not null,
+# all startup DDL, run as one script in a single transaction
+_BOOTSTRAP_SQL = """
+BEGIN;
 
-            rating integer not null
-                check (rating >= 0 and rating <= 10),   -- rating /10
-            comment text not null,          -- written feedback by user as text
-            flagged integer default 0,      -- review moderation flag, it will be 1 if flagged but default is 0
+create table if not exists reviews (
+    id integer primary key autoincrement,
 
-            created_at text default current_timestamp,   -- when the review was created
-            updated_at text default current_timestamp,    -- when the review was last updated
+    -- id of the user which is submitting the review
+    user_id integer not null,
+
+    -- id of the room that is being reviewed
+    room_id integer not null,
+
+    rating integer not null
+        check (rating >= 0 and rating <= 10),   -- rating /10
+    comment text not null,          -- written feedback by user as text
+    flagged integer default 0,      -- review moderation flag, it will be 1 if flagged but default is 0
+
+    created_at text default current_timestamp,   -- when the review was created
+    updated_at text default current_timestamp,    -- when the review was last updated
+
+    -- Foreign keys
+    foreign key(user_id) references users(id),
+    foreign key(room_id) references rooms(id)
+);
+
+-- NEW: indexes to speed up listing/filtering reviews
+-- (room_id, created_at desc) also hands get_reviews_for_room its rows
+-- already sorted, and makes the old room_id-only index redundant
+create index if not exists idx_reviews_room_created on reviews(room_id, created_at desc);
+drop index if exists idx_reviews_room;
+create index if not exists idx_reviews_user on reviews(user_id);
+
+COMMIT;
+
+-- let sqlite refresh its planner stats
+PRAGMA optimize;
+"""
 
-            -- Foreign keys
-            foreign key(user_id) references users(id),
-            foreign key(room_id) references rooms(id)
-        );
-        """
-    )
 
-    # NEW: indexes to speed up listing/filtering reviews
-    cur.execute(
-        "create index if not exists idx_reviews_room on reviews(room_id);"
-    )
-    cur.execute(
-        "create index if not exists idx_reviews_user on reviews(user_id);"
-    )
+def make_reviews_table_if_missing():
+    """Create the ``reviews`` table if it does not already exist.
+    
+    Takes no parameters.
 
-    conn.commit()
-    conn.close()
+    Returns
+    None
+        Simply ensures the table exists in the database.
+    """
+    with get_conn() as conn:
+        conn.executescript(_BOOTSTRAP_SQL)
 
 
 def submit_review(user_id, room_id, rating, comment):
@@ -89,21 +213,27 @@ def submit_review(user_id, room_id, rating, comment):
     int
         The auto-generated ID of the newly created review.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
+    with get_conn() as conn:
+        cur = conn.execute(_SQL["submit"], (user_id, room_id, rating, comment))
+        return cur.lastrowid
 
-    cur.execute(
-        """
-        insert into reviews (user_id, room_id, rating, comment)
-        values (?, ?, ?, ?);
-        """,
-        (user_id, room_id, rating, comment),
-    )
 
-    conn.commit()
-    review_id = cur.lastrowid
-    conn.close()
-    return review_id
+def submit_reviews_bulk(rows):
+    """Insert many reviews at once inside a single transaction.
+
+    Parameters
+    rows : list of tuple
+        ``(user_id, room_id, rating, comment)`` tuples, one per review.
+
+    Returns
+    int
+        Number of reviews inserted.
+    """
+    with get_conn() as conn:
+        conn.execute("begin")
+        cur = conn.executemany(_SQL["submit"], rows)
+        conn.execute("commit")
+        return cur.rowcount
 
 
 def update_review(review_id, rating, comment):
@@ -121,20 +251,8 @@ def update_review(review_id, rating, comment):
     None
         The review row is updated in-place.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        update reviews
-        set rating = ?, comment = ?, updated_at = current_timestamp
-        where id = ?;
-        """,
-        (rating, comment, review_id),
-    )
-
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        conn.execute(_SQL["update"], (rating, comment, review_id))
 
 
 def delete_review(review_id):
@@ -148,44 +266,23 @@ def delete_review(review_id):
     None
         The review row is removed from the database.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute(
-        "delete from reviews where id = ?;",
-        (review_id,),
-    )
-
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        conn.execute(_SQL["delete"], (review_id,))
 
 
 def get_reviews_for_room(room_id):
-    """Return all reviews for a specific room.
+    """Return all reviews for a specific room, newest first.
 
     Parameters
     room_id : int
         ID of the room for which reviews are requested.
 
     Returns
-    list of sqlite3.Row
+    list of dict
         A list of rows containing review data for this room.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        select * from reviews
-        where room_id = ?
-        order by created_at desc;
-        """,
-        (room_id,),
-    )
-
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+    with get_conn() as conn:
+        return conn.execute(_SQL["for_room"], (room_id,)).fetchall()
 
 
 def flag_review(review_id):
@@ -199,20 +296,8 @@ def flag_review(review_id):
     None
         Updates the 'flagged' field of the given review.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        update reviews
-        set flagged = 1, updated_at = current_timestamp
-        where id = ?;
-        """,
-        (review_id,),
-    )
-
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        conn.execute(_SQL["flag"], (review_id,))
 
 
 def find_review_by_id(review_id):
@@ -225,52 +310,45 @@ def find_review_by_id(review_id):
 
     Returns
     -------
-    sqlite3.Row or None
+    dict or None
         The review row if it exists, otherwise None.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("select * from reviews where id = ?;", (review_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+    with get_conn() as conn:
+        return conn.execute(_SQL["review_by_id"], (review_id,)).fetchone()
 
 
 def find_user_by_id(user_id):
     """This fct will retrieve a single user row using the user's ID.
 
+    Not cached: users are owned by the users service and can be deleted at
+    any time, a stale row would let a review through for a user that's gone.
+
     Parameters
     user_id : int
         The ID of the user to look up.
 
     Returns
-    sqlite3.Row or None
+    dict or None
         The user row if found, None otherwise.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("select * from users where id = ?;", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+    with get_conn() as conn:
+        return conn.execute(_SQL["user_by_id"], (user_id,)).fetchone()
 
 
 def find_room_by_id(room_id):
     """This fct will retrieve a single room row using the room's ID.
 
+    Not cached either, for the same reason as users.
+
     Parameters
     room_id : int
         The ID of the room to look up.
 
     Returns
-    sqlite3.Row or None
+    dict or None
         The room row if found, None otherwise.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("select * from rooms where id = ?;", (room_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+    with get_conn() as conn:
+        return conn.execute(_SQL["room_by_id"], (room_id,)).fetchone()
 
 #make_reviews_table_if_missing()
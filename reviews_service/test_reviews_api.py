@@ -5,10 +5,10 @@ import pytest
 # Support both package-style and local imports, exactly like bookings
 try:
     from reviews_service.app import app
-    from reviews_service.database import submit_review
+    from reviews_service.database import submit_reviews_bulk
 except ImportError:
     from app import app
-    from database import submit_review
+    from database import submit_reviews_bulk
 
 # Path to the shared SQLite DB (same logic as bookings tests)
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "database.db")
@@ -22,58 +22,68 @@ DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "database.db"
 @pytest.fixture(autouse=True)
 def fresh_db():
     conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA foreign_keys = OFF;") 
 
-    # Correct deletion order:
-    conn.execute("DELETE FROM reviews;")
-    conn.execute("DELETE FROM rooms;")
-    conn.execute("DELETE FROM users;")
-
-    conn.commit()
-    conn.execute("PRAGMA foreign_keys = ON;")
+    # Correct deletion order, all three deletes in one transaction:
+    conn.executescript(
+        """
+        PRAGMA foreign_keys = OFF;
+        BEGIN;
+        DELETE FROM reviews;
+        DELETE FROM rooms;
+        DELETE FROM users;
+        COMMIT;
+        PRAGMA foreign_keys = ON;
+        """
+    )
     conn.close()
 
 
 
 
 
-# Helper seeders
+# Helper seeder
 
-def seed_user(name, username, email, role):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO users (name, username, email, role, password_hash, created_at)
-        VALUES (?, ?, ?, ?, 'hash', 'now');
-        """,
-        (name, username, email, role),
-    )
-    conn.commit()
-    uid = cur.lastrowid
-    conn.close()
-    return uid
+def seed(users=(), rooms=(), reviews=()):
+    """Insert all seed rows in one transaction, one executemany per table.
 
+    users   : (name, username, email, role) tuples
+    rooms   : (name, capacity) tuples
+    reviews : (username, room_name, rating, comment) tuples, linked by name
 
-def seed_room(name="NicelyHall", capacity=12):
+    Returns {"users": {username: id}, "rooms": {name: id}, "reviews": [id, ...]}
+    """
     conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO rooms (name, capacity, equipment, location, status)
-        VALUES (?, ?, 'Projector', 'AUB Beirut', 'active');
-        """,
-        (name, capacity),
-    )
-    conn.commit()
-    rid = cur.lastrowid
+    with conn:
+        conn.executemany(
+            """
+            INSERT INTO users (name, username, email, role, password_hash, created_at)
+            VALUES (?, ?, ?, ?, 'hash', 'now');
+            """,
+            users,
+        )
+        conn.executemany(
+            """
+            INSERT INTO rooms (name, capacity, equipment, location, status)
+            VALUES (?, ?, 'Projector', 'AUB Beirut', 'active');
+            """,
+            rooms,
+        )
+        conn.executemany(
+            """
+            INSERT INTO reviews (user_id, room_id, rating, comment)
+            SELECT u.id, r.id, ?, ? FROM users u, rooms r
+            WHERE u.username = ? AND r.name = ?;
+            """,
+            [(rating, comment, username, room) for username, room, rating, comment in reviews],
+        )
+    # tables are wiped before each test, so everything here was just seeded
+    ids = {
+        "users": dict(conn.execute("SELECT username, id FROM users;").fetchall()),
+        "rooms": dict(conn.execute("SELECT name, id FROM rooms;").fetchall()),
+        "reviews": [r[0] for r in conn.execute("SELECT id FROM reviews ORDER BY id;")],
+    }
     conn.close()
-    return rid
-
-
-def seed_review(user_id, room_id, rating=8, comment="Nice room!"):
-    """Use the REAL DB helper for reviews."""
-    return submit_review(user_id, room_id, rating, comment)
+    return ids
 
 
 
@@ -94,9 +104,12 @@ def test_list_reviews_room_not_found(client):
 
 
 def test_list_reviews_success(client):
-    uid = seed_user("Maya", "maya_beirut", "maya@aub.edu.lb", "regular")
-    rid = seed_room()
-    seed_review(uid, rid, 9, "Great room!")
+    ids = seed(
+        users=[("Maya", "maya_beirut", "maya@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+        reviews=[("maya_beirut", "NicelyHall", 9, "Great room!")],
+    )
+    rid = ids["rooms"]["NicelyHall"]
 
     res = client.get(f"/reviews/room/{rid}")
 
@@ -105,11 +118,33 @@ def test_list_reviews_success(client):
     assert res.json[0]["comment"] == "Great room!"
 
 
+def test_list_reviews_after_bulk_insert(client):
+    ids = seed(
+        users=[("Karim", "karim_saida", "karim@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+    )
+    uid = ids["users"]["karim_saida"]
+    rid = ids["rooms"]["NicelyHall"]
+    inserted = submit_reviews_bulk(
+        [(uid, rid, 5, "ok"), (uid, rid, 8, "good"), (uid, rid, 10, "perfect")]
+    )
+
+    res = client.get(f"/reviews/room/{rid}")
+
+    assert inserted == 3
+    assert res.status_code == 200
+    assert {r["comment"] for r in res.json} == {"ok", "good", "perfect"}
+
+
 # TEST GROUP 2 POST /reviews  (submit_review_route)
 
 def test_submit_review_regular_success(client):
-    uid = seed_user("Riwa", "riwaelkari", "riwa@aub.edu.lb", "regular")
-    rid = seed_room()
+    ids = seed(
+        users=[("Riwa", "riwaelkari", "riwa@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+    )
+    uid = ids["users"]["riwaelkari"]
+    rid = ids["rooms"]["NicelyHall"]
 
     payload = {
         "user_id": uid,
@@ -128,9 +163,39 @@ def test_submit_review_regular_success(client):
     assert "review_id" in res.json
 
 
+def test_submit_review_user_deleted_after_lookup(client):
+    ids = seed(
+        users=[("Lina", "lina_tyre", "lina@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+    )
+    uid = ids["users"]["lina_tyre"]
+    rid = ids["rooms"]["NicelyHall"]
+    headers = {"X-User-Role": "admin", "X-User-Name": "adminuser"}
+    payload = {"user_id": uid, "room_id": rid, "rating": 6, "comment": "fine"}
+
+    # first submit looks the user up once
+    assert client.post("/reviews", json=payload, headers=headers).status_code == 201
+
+    # the users service deletes the user behind our back
+    conn = sqlite3.connect(DB_PATH)
+    with conn:
+        conn.execute("DELETE FROM reviews WHERE user_id = ?;", (uid,))
+        conn.execute("DELETE FROM users WHERE id = ?;", (uid,))
+    conn.close()
+
+    res = client.post("/reviews", json=payload, headers=headers)
+
+    assert res.status_code == 404
+    assert "user not found" in res.json["error"]
+
+
 def test_submit_review_regular_wrong_owner(client):
-    uid = seed_user("Ali", "ali123", "ali@aub.edu.lb", "regular")
-    rid = seed_room()
+    ids = seed(
+        users=[("Ali", "ali123", "ali@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+    )
+    uid = ids["users"]["ali123"]
+    rid = ids["rooms"]["NicelyHall"]
 
     payload = {
         "user_id": uid,
@@ -153,9 +218,12 @@ def test_submit_review_regular_wrong_owner(client):
 # TEST GROUP 3 PUT /reviews/<id>  (update_review_route)
 
 def test_update_review_owner_success(client):
-    uid = seed_user("Nour", "nour123", "nour@aub.edu.lb", "regular")
-    rid = seed_room()
-    rev_id = seed_review(uid, rid, 5, "Okay")
+    ids = seed(
+        users=[("Nour", "nour123", "nour@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+        reviews=[("nour123", "NicelyHall", 5, "Okay")],
+    )
+    rev_id = ids["reviews"][0]
 
     res = client.put(
         f"/reviews/{rev_id}",
@@ -168,9 +236,12 @@ def test_update_review_owner_success(client):
 
 
 def test_update_review_forbidden_other_user(client):
-    uid = seed_user("Dana", "dana123", "dana@aub.edu.lb", "regular")
-    rid = seed_room()
-    rev_id = seed_review(uid, rid, 8, "Good")
+    ids = seed(
+        users=[("Dana", "dana123", "dana@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+        reviews=[("dana123", "NicelyHall", 8, "Good")],
+    )
+    rev_id = ids["reviews"][0]
 
     res = client.put(
         f"/reviews/{rev_id}",
@@ -185,9 +256,12 @@ def test_update_review_forbidden_other_user(client):
 
 # TEST GROUP 4 DELETE /reviews/<id> (delete_review_route)
 def test_delete_review_owner_success(client):
-    uid = seed_user("Karim", "karim123", "karim@aub.edu.lb", "regular")
-    rid = seed_room()
-    rev_id = seed_review(uid, rid)
+    ids = seed(
+        users=[("Karim", "karim123", "karim@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+        reviews=[("karim123", "NicelyHall", 8, "Nice room!")],
+    )
+    rev_id = ids["reviews"][0]
 
     res = client.delete(
         f"/reviews/{rev_id}",
@@ -199,9 +273,12 @@ def test_delete_review_owner_success(client):
 
 
 def test_delete_review_moderator_can_delete_any(client):
-    uid = seed_user("Jad", "jad123", "jad@aub.edu.lb", "regular")
-    rid = seed_room()
-    rev_id = seed_review(uid, rid)
+    ids = seed(
+        users=[("Jad", "jad123", "jad@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+        reviews=[("jad123", "NicelyHall", 8, "Nice room!")],
+    )
+    rev_id = ids["reviews"][0]
 
     res = client.delete(
         f"/reviews/{rev_id}",
@@ -213,9 +290,12 @@ def test_delete_review_moderator_can_delete_any(client):
 
 
 def test_delete_review_forbidden_regular_other_user(client):
-    uid = seed_user("Tala", "tala123", "tala@aub.edu.lb", "regular")
-    rid = seed_room()
-    rev_id = seed_review(uid, rid)
+    ids = seed(
+        users=[("Tala", "tala123", "tala@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+        reviews=[("tala123", "NicelyHall", 8, "Nice room!")],
+    )
+    rev_id = ids["reviews"][0]
 
     res = client.delete(
         f"/reviews/{rev_id}",
@@ -229,9 +309,12 @@ def test_delete_review_forbidden_regular_other_user(client):
 
 # TEST GROUP 5 PUT /reviews/<id>/flag (flag_review_route)
 def test_flag_review_success_admin(client):
-    uid = seed_user("Layla", "layla123", "layla@aub.edu.lb", "regular")
-    rid = seed_room()
-    rev_id = seed_review(uid, rid)
+    ids = seed(
+        users=[("Layla", "layla123", "layla@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+        reviews=[("layla123", "NicelyHall", 8, "Nice room!")],
+    )
+    rev_id = ids["reviews"][0]
 
     res = client.put(
         f"/reviews/{rev_id}/flag",
@@ -243,9 +326,12 @@ def test_flag_review_success_admin(client):
 
 
 def test_flag_review_forbidden_non_moderator(client):
-    uid = seed_user("Tony", "tony123", "tony@aub.edu.lb", "regular")
-    rid = seed_room()
-    rev_id = seed_review(uid, rid)
+    ids = seed(
+        users=[("Tony", "tony123", "tony@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+        reviews=[("tony123", "NicelyHall", 8, "Nice room!")],
+    )
+    rev_id = ids["reviews"][0]
 
     res = client.put(
         f"/reviews/{rev_id}/flag",
@@ -260,7 +346,10 @@ def test_flag_review_forbidden_non_moderator(client):
 # MISSING TESTS
 
 def test_submit_review_missing_fields(client):
-    uid = seed_user("Test", "test123", "t@aub.edu.lb", "regular")
+    ids = seed(
+        users=[("Test", "test123", "t@aub.edu.lb", "regular")],
+    )
+    uid = ids["users"]["test123"]
 
     res = client.post(
         "/reviews",
@@ -273,8 +362,12 @@ def test_submit_review_missing_fields(client):
 
 
 def test_submit_review_invalid_rating(client):
-    uid = seed_user("Sam", "sam123", "sam@aub.edu.lb", "regular")
-    rid = seed_room()
+    ids = seed(
+        users=[("Sam", "sam123", "sam@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+    )
+    uid = ids["users"]["sam123"]
+    rid = ids["rooms"]["NicelyHall"]
 
     res = client.post(
         "/reviews",
@@ -286,8 +379,12 @@ def test_submit_review_invalid_rating(client):
 
 
 def test_submit_review_empty_comment(client):
-    uid = seed_user("Lina", "lina123", "lina@aub.edu.lb", "regular")
-    rid = seed_room()
+    ids = seed(
+        users=[("Lina", "lina123", "lina@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+    )
+    uid = ids["users"]["lina123"]
+    rid = ids["rooms"]["NicelyHall"]
 
     res = client.post(
         "/reviews",
@@ -330,3 +427,24 @@ def test_submit_review_missing_auth(client):
     res = client.post("/reviews", json={})
     assert res.status_code == 401
     assert "authentication required" in res.json["error"]
+
+
+def test_submit_review_internal_error_body_is_generic(client, monkeypatch):
+    import sys
+
+    ids = seed(
+        users=[("Omar", "omar_zahle", "omar@aub.edu.lb", "regular")],
+        rooms=[("NicelyHall", 12)],
+    )
+    reviews_app = sys.modules[app.import_name]
+    monkeypatch.setattr(reviews_app, "submit_review", lambda *args: None)
+
+    res = client.post(
+        "/reviews",
+        json={"user_id": ids["users"]["omar_zahle"], "room_id": ids["rooms"]["NicelyHall"],
+              "rating": 5, "comment": "ok"},
+        headers={"X-User-Role": "regular", "X-User-Name": "omar_zahle"},
+    )
+
+    assert res.status_code == 500
+    assert res.json == {"error": "internal server error"}
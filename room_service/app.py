@@ -2,12 +2,20 @@
 creating, updating, deleting, listing, and checking availability.
 """
 import os
+import atexit
+import hashlib
 import logging
+import logging.handlers
+import queue
 from flask_talisman import Talisman
 import jwt
-from flask import Flask, jsonify, request, g
+import orjson
+from flask import Flask, Response, request, g
+from werkzeug.exceptions import BadRequest
 from functools import wraps
-import time   # <-- NEW
+import threading
+from flask_caching import Cache
+from cachetools import TTLCache
 
 
 from prometheus_flask_exporter import PrometheusMetrics
@@ -22,15 +30,48 @@ sentry_sdk.init(
 
 AUTH_SECRET_KEY = os.environ.get("AUTH_SECRET_KEY", "dev-secret-key-change-me")
 
-# --- Simple in-memory cache for rooms (NEW) ------------------------------
-ROOMS_CACHE_TTL = 30.0  # seconds
-
-_all_rooms_cache = {"data": None, "expires_at": 0.0}
-_available_rooms_cache = {}  # key -> (data, expires_at)
+# --- In-memory cache for rooms (Flask-Caching) ----------------------------
+ROOMS_CACHE_TTL = 30  # seconds
+
+# SimpleCache evicts once it holds CACHE_THRESHOLD keys. it makes no
+# thread-safety promise, so every get/set/clear on it runs under _cache_lock
+cache = Cache(config={
+    "CACHE_TYPE": "SimpleCache",
+    "CACHE_DEFAULT_TIMEOUT": ROOMS_CACHE_TTL,
+    "CACHE_THRESHOLD": 500,
+})
+ALL_ROOMS_CACHE_KEY = "rooms:all"
+# /rooms/available results, one entry per query string. kept in a fixed size
+# LRU (oldest-used entry dropped in O(1)) instead of SimpleCache whose prune
+# walks every key once the threshold is hit. TTLCache is not thread-safe, so
+# every access goes through _cache_lock.
+AVAILABLE_ROOMS_CACHE_SIZE = 256
+_available_rooms_cache = TTLCache(maxsize=AVAILABLE_ROOMS_CACHE_SIZE, ttl=ROOMS_CACHE_TTL)
+# guards both caches, _refill_locks and _cache_generation. only ever held for
+# a dict lookup/store, never across a DB query
+_cache_lock = threading.Lock()
+# one lock per cache key that's being refilled, so a miss only makes the other
+# requests for that same key wait (single-flight), never the cache hits
+_refill_locks = {}
+# bumped by invalidate_rooms_cache; a refill that started before an
+# invalidation doesn't store its (possibly stale) result
+_cache_generation = 0
 
 def get_current_user():
-    """Read current user identity, preferring Bearer token, then X-User-* headers."""
-    auth_header = request.headers.get("Authorization", "")
+    """Read current user identity, preferring Bearer token, then X-User-* headers.
+    the result is kept on ``g`` so the token is decoded at most once per request
+    (audit_request and require_roles both ask for it).
+    """
+    identity = getattr(g, "_user_identity", None)
+    if identity is None:
+        identity = g._user_identity = _read_user_identity()
+    return identity
+
+
+def _read_user_identity():
+    # read straight from the WSGI environ, skips the EnvironHeaders wrapper
+    env = request.environ
+    auth_header = env.get("HTTP_AUTHORIZATION", "")
     if auth_header.startswith("Bearer "):
         token = auth_header[7:]
         try:
@@ -41,29 +82,23 @@ def get_current_user():
         except jwt.InvalidTokenError:
             return None, None
 
-    username = request.headers.get("X-User-Name")
-    role = request.headers.get("X-User-Role")
-    return username, role
+    return env.get("HTTP_X_USER_NAME"), env.get("HTTP_X_USER_ROLE")
 
 
 def require_roles(*allowed_roles):
     """Decorator to enforce that current user has one of the allowed roles."""
+    # built once per decorated view, not on every request
+    allowed_set = frozenset(allowed_roles)
+    forbidden_msg = "forbidden: requires one of roles: " + ", ".join(allowed_roles)
+
     def decorator(view_func):
         @wraps(view_func)
         def wrapped(*args, **kwargs):
             username, role = get_current_user()
             if role is None:
-                return jsonify({"error": "missing X-User-Role header"}), 401
-            if role not in allowed_roles:
-                return (
-                    jsonify(
-                        {
-                            "error": "forbidden: requires one of roles: "
-                            + ", ".join(allowed_roles)
-                        }
-                    ),
-                    403,
-                )
+                return ojson({"error": "missing X-User-Role header"}, 401)
+            if role not in allowed_set:
+                return ojson({"error": forbidden_msg}, 403)
             return view_func(*args, **kwargs)
         return wrapped
     return decorator
@@ -90,58 +125,145 @@ except ImportError:
     )
 
 
+def ojson(payload, code=200):
+    """JSON response encoded with orjson (bytes straight out, no str step)."""
+    return Response(
+        orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS),
+        status=code,
+        mimetype="application/json",
+    )
+
+
+def read_json_body():
+    """parse the request body with orjson.
+    an empty (or ``null``) body gives ``{}``, invalid JSON is a 400 like ``request.get_json()``.
+    """
+    raw = request.get_data(cache=False)
+    if not raw:
+        return {}
+    try:
+        return orjson.loads(raw) or {}
+    except orjson.JSONDecodeError:
+        raise BadRequest("invalid JSON body")
+
+
+def parse_int_arg(name):
+    """read an optional integer query argument, parsed once per request.
+    returns ``None`` if the argument is absent, raises ``ValueError`` if it is not an integer.
+    """
+    parsed = g.setdefault("_int_args", {})
+    if name not in parsed:
+        raw = request.args.get(name)
+        parsed[name] = None if raw is None else int(raw)
+    return parsed[name]
+
+
+def parse_capacity(value):
+    """Turn a JSON capacity value into an int, or None if it isn't one.
+    ints are returned as-is; strings must be (optionally signed, padded)
+    decimal digits.
+    """
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = value.strip()
+        digits = value[1:] if value[:1] in ("-", "+") else value
+        if not digits.isdecimal():
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            # e.g. more digits than int() converts (sys.get_int_max_str_digits)
+            return None
+    # anything else (floats etc.) keeps the old int() behaviour
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
 # --- Caching helpers (NEW) -----------------------------------------------
 def _availability_cache_key(min_capacity, location, equipment_contains):
     """Turn query parameters into a deterministic cache key."""
-    return f"{min_capacity}|{location}|{equipment_contains}"
+    return (min_capacity, location, equipment_contains)
+
+
+def _cached_or_refill(lookup, store, key, refill):
+    """Return the cached entry for ``key``, running ``refill()`` on a miss.
+    ``lookup``/``store`` only touch the cache and run under ``_cache_lock``;
+    ``refill`` (the DB query) runs outside it, one caller per key at a time.
+    """
+    with _cache_lock:
+        entry = lookup(key)
+    if entry is not None:
+        return entry
+
+    with _cache_lock:
+        refill_lock = _refill_locks.setdefault(key, threading.Lock())
+    with refill_lock:
+        # another thread may have refilled it while we waited
+        with _cache_lock:
+            entry = lookup(key)
+            generation = _cache_generation
+        if entry is not None:
+            return entry
+
+        try:
+            entry = refill()
+            with _cache_lock:
+                if generation == _cache_generation:
+                    store(key, entry)
+        finally:
+            # keys come from query strings: never leave a lock behind, even
+            # when the query fails
+            with _cache_lock:
+                _refill_locks.pop(key, None)
+    return entry
 
 
 def get_cached_all_rooms():
-    """Return cached list of all rooms, or refresh cache if expired."""
-    now = time.time()
-    if (
-        _all_rooms_cache["data"] is not None
-        and _all_rooms_cache["expires_at"] > now
-    ):
-        return _all_rooms_cache["data"]
+    """Return cached list of all rooms, or refresh cache if expired.
+    returns a ``(json_bytes, etag)`` pair. the JSON text is stored already
+    utf-8 encoded so a hit is written out as is, and the ETag is a hash of
+    exactly those bytes so it changes whenever the listing does.
+    """
+    def refill():
+        data = list_all_rooms().encode()
+        return (data, hashlib.md5(data, usedforsecurity=False).hexdigest())
 
-    data = list_all_rooms()
-    _all_rooms_cache["data"] = data
-    _all_rooms_cache["expires_at"] = now + ROOMS_CACHE_TTL
-    return data
+    return _cached_or_refill(cache.get, cache.set, ALL_ROOMS_CACHE_KEY, refill)
 
 
 def get_cached_available_rooms(min_capacity=None, location=None, equipment_contains=None):
     """Return cached search results for /rooms/available."""
     key = _availability_cache_key(min_capacity, location, equipment_contains)
-    now = time.time()
-    entry = _available_rooms_cache.get(key)
 
-    if entry is not None:
-        data, expires_at = entry
-        if expires_at > now:
-            return data
+    def refill():
+        return search_available_rooms(
+            min_capacity=min_capacity,
+            location=location,
+            equipment_contains=equipment_contains,
+        ).encode()
 
-    data = search_available_rooms(
-        min_capacity=min_capacity,
-        location=location,
-        equipment_contains=equipment_contains,
+    return _cached_or_refill(
+        _available_rooms_cache.get, _available_rooms_cache.__setitem__, key, refill
     )
-    _available_rooms_cache[key] = (data, now + ROOMS_CACHE_TTL)
-    return data
 
 
 def invalidate_rooms_cache():
     """Clear cache after any change to rooms."""
-    _all_rooms_cache["data"] = None
-    _all_rooms_cache["expires_at"] = 0.0
-    _available_rooms_cache.clear()
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        cache.clear()
+        _available_rooms_cache.clear()
 
 
 
 
 app = Flask(__name__)
 metrics = PrometheusMetrics(app, group_by='endpoint')
+cache.init_app(app)
 Talisman(app, content_security_policy=None, force_https=False)
 
 from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
@@ -171,17 +293,32 @@ logger = logging.getLogger("room_service")
 logger.setLevel(logging.INFO)
 
 if not logger.handlers:
+    # request threads only put records on a queue, one background listener
+    # thread does the actual file writes
     file_handler = logging.FileHandler(os.path.join(LOG_DIR, "room_service.log"))
     formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+    log_listener.start()
+    # stop() drains whatever is still queued before the process exits
+    atexit.register(log_listener.stop)
 # ── Auditing hooks ───────────────────────────────────────────────────────
+# only these views check roles; for the public GETs the caller identity is
+# never used, so we don't pay for decoding a JWT just to log it
+_AUTHENTICATED_ENDPOINTS = frozenset({"create_room", "update_room", "delete_room"})
+
+
 @app.before_request
 def audit_request():
-    try:
-        username, role = get_current_user()
-    except Exception:
-        username, role = None, None
+    username, role = None, None
+    if request.endpoint in _AUTHENTICATED_ENDPOINTS:
+        try:
+            username, role = get_current_user()
+        except Exception:
+            pass
 
     g.audit_username = username or "anonymous"
     g.audit_role = role or "none"
@@ -225,61 +362,63 @@ def create_room():
     takes in a JSON body with name, capacity, equipment, location, and optional status( "available" or "booked", defaults to "available").
     returns JSON response with appropriate status code meaning 4xx/5xx if error, 201 if room created.
     """
-    data = request.get_json() or {}
+    data = read_json_body()
 
     needed = ["name", "capacity", "equipment", "location"]
     missing = [x for x in needed if not data.get(x)]
     if missing:
-        return jsonify({"error": f"missing: {', '.join(missing)}"}), 400
+        return ojson({"error": f"missing: {', '.join(missing)}"}, 400)
 
     name = data["name"]
-    if find_room_by_name(name):
-        return jsonify({"error": "room name already exists"}), 400
-
-    try:
-        capacity = int(data["capacity"])
-    except (TypeError, ValueError):
-        return jsonify({"error": "capacity must be an integer"}), 400
+    capacity = parse_capacity(data["capacity"])
+    if capacity is None:
+        return ojson({"error": "capacity must be an integer"}, 400)
 
     equipment = data["equipment"]
     location = data["location"]
     status = data.get("status", "available")
 
+    # the insert itself detects a taken name, no separate lookup needed
     created = insert_room(name, capacity, equipment, location, status)
     if not created:
-        return jsonify({"error": "could not create room"}), 500
+        return ojson({"error": "room name already exists"}, 400)
 
     invalidate_rooms_cache()  # <-- NEW
 
-    return jsonify({"message": "room created", "room": created}), 201
+    return ojson({"message": "room created", "room": created}, 201)
 
 
 @app.route("/rooms", methods=["GET"])
 def get_all_rooms():
-    """return all rooms in the system as a JSON list (with simple caching)."""
-    all_rooms = get_cached_all_rooms()          # <-- uses cache
-    return jsonify(all_rooms), 200
+    """return all rooms in the system as a JSON list (with simple caching).
+    sends an ETag; a client that already has this version (If-None-Match) gets a 304 with no body.
+    """
+    all_rooms, etag = get_cached_all_rooms()    # <-- uses cache, already encoded JSON bytes
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(all_rooms, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = f"max-age={ROOMS_CACHE_TTL}"
+    return response
 
 
 @app.route("/rooms/available", methods=["GET"])
 def get_available_rooms():
     """returns available rooms, optionally filtered by capacity, location, equipment."""
-    min_capacity = request.args.get("min_capacity")
+    try:
+        min_capacity = parse_int_arg("min_capacity")
+    except ValueError:
+        return ojson({"error": "min_capacity must be an integer"}, 400)
     location = request.args.get("location")
     equipment_contains = request.args.get("equipment_contains")
 
-    if min_capacity is not None:
-        try:
-            min_capacity = int(min_capacity)
-        except ValueError:
-            return jsonify({"error": "min_capacity must be an integer"}), 400
-
     rooms = get_cached_available_rooms(       # <-- uses cache
         min_capacity=min_capacity,
         location=location,
         equipment_contains=equipment_contains,
     )
-    return jsonify(rooms), 200
+    return Response(rooms, mimetype="application/json"), 200
 
 
 @app.route("/rooms/<string:name>", methods=["GET"])
@@ -287,8 +426,11 @@ def get_room(name):
     """just returns a single room by name."""
     room = find_room_by_name(name)
     if not room:
-        return jsonify({"error": "room not found"}), 404
-    return jsonify(room), 200
+        return ojson({"error": "room not found"}, 404)
+    return ojson(room)
+
+
+_UPDATABLE_FIELDS = ("capacity", "equipment", "location", "status")
 
 
 @app.route("/rooms/<string:name>", methods=["PUT"])
@@ -298,50 +440,44 @@ def update_room(name):
     accepts a JSON body with capacity, equipment, location, and/or status fields to update.
     returns JSON response with appropriate status code 4xx/5xx if error, 200 if room updated.
     """
-    data = request.get_json() or {}
-
-    existing = find_room_by_name(name)
-    if not existing:
-        return jsonify({"error": "room not found"}), 404
+    data = read_json_body()
+    # nothing to change: answer before touching the database
+    if not any(field in data for field in _UPDATABLE_FIELDS):
+        return ojson({"error": "empty body"}, 400)
 
+    # fields left out stay as they are (update_room_row coalesces None)
+    new_capacity = None
     if "capacity" in data:
-        try:
-            new_capacity = int(data["capacity"])
-        except (TypeError, ValueError):
-            return jsonify({"error": "capacity must be an integer"}), 400
-    else:
-        new_capacity = existing["capacity"]
-
-    new_equipment = data.get("equipment", existing["equipment"])
-    new_location = data.get("location", existing["location"])
-    new_status = data.get("status", existing["status"])
+        new_capacity = parse_capacity(data["capacity"])
+        if new_capacity is None:
+            return ojson({"error": "capacity must be an integer"}, 400)
 
     updated = update_room_row(
-        name, new_capacity, new_equipment, new_location, new_status
+        name,
+        new_capacity,
+        data.get("equipment"),
+        data.get("location"),
+        data.get("status"),
     )
     if not updated:
-        return jsonify({"error": "could not update room"}), 500
+        return ojson({"error": "room not found"}, 404)
 
     invalidate_rooms_cache()  # <-- NEW
 
-    return jsonify({"message": "room updated", "room": updated}), 200
+    return ojson({"message": "room updated", "room": updated})
 
 
 @app.route("/rooms/<string:name>", methods=["DELETE"])
 @require_roles("admin", "facility_manager")
 def delete_room(name):
     """delete room by name."""
-    existing = find_room_by_name(name)
-    if not existing:
-        return jsonify({"error": "room not found"}), 404
-
     rows_deleted = delete_room_row(name)
     if rows_deleted == 0:
-        return jsonify({"error": "nothing deleted"}), 500
+        return ojson({"error": "room not found"}, 404)
 
     invalidate_rooms_cache()  # <-- NEW
 
-    return jsonify({"message": f"room {name} deleted"}), 200
+    return ojson({"message": f"room {name} deleted"})
 
 
 @app.route("/rooms/<string:name>/status", methods=["GET"])
@@ -349,9 +485,9 @@ def get_room_status(name):
     """basically return the status of a room: available or booked."""
     room = find_room_by_name(name)
     if not room:
-        return jsonify({"error": "room not found"}), 404
+        return ojson({"error": "room not found"}, 404)
 
-    return jsonify({"name": room["name"], "status": room["status"]}), 200
+    return ojson({"name": room["name"], "status": room["status"]})
 
 # --- Avoid applying JSON error handlers to /metrics ---
 @app.before_request
@@ -365,39 +501,45 @@ def _allow_metrics_route():
 @app.errorhandler(400)
 def handle_400(e):
     logger.warning(f"BadRequest: {str(e)}")
-    return jsonify({"error": "bad request"}), 400
+    return ojson({"error": "bad request"}, 400)
 
 @app.errorhandler(401)
 def handle_401(e):
     logger.warning(f"Unauthorized: {str(e)}")
-    return jsonify({"error": "unauthorized"}), 401
+    return ojson({"error": "unauthorized"}, 401)
 
 @app.errorhandler(403)
 def handle_403(e):
     logger.warning(f"Forbidden: {str(e)}")
-    return jsonify({"error": "forbidden"}), 403
+    return ojson({"error": "forbidden"}, 403)
 
 @app.errorhandler(404)
 def handle_404(e):
     if request.path == "/metrics":
         return e
     logger.warning(f"NotFound: {str(e)}")
-    return jsonify({"error": "not found"}), 404
+    return ojson({"error": "not found"}, 404)
 
 @app.errorhandler(500)
 def handle_500(e):
     logger.error(f"Internal Server Error: {str(e)}")
-    return jsonify({"error": "internal server error"}), 500
+    return ojson({"error": "internal server error"}, 500)
 
 # fallback for *any* other uncaught exception
 @app.errorhandler(Exception)
 def handle_generic(e):
     logger.exception("Unhandled exception in room_service")
-    return jsonify({"error": "internal server error"}), 500
+    return ojson({"error": "internal server error"}, 500)
 
 
 if __name__ == "__main__":
     make_rooms_table_if_missing()
     port = int(os.environ.get("ROOM_SERVICE_PORT", 5002))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    if os.environ.get("FLASK_ENV") == "dev":
+        # werkzeug dev server with the reloader/debugger, local use only
+        app.run(host="0.0.0.0", port=port, debug=True)
+    else:
+        # threaded WSGI server, each worker thread keeps its own SQLite connection
+        from waitress import serve
+        serve(app, host="0.0.0.0", port=port, threads=8)
  
@@ -3,21 +3,126 @@ This part of the project is the databse of the rooms service.
 """
 import sqlite3
 import os
+import re
+import atexit
 import logging
+import threading
 logger = logging.getLogger("room_service")
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 DEFAULT_DB_FILE = os.path.join(BASE_DIR, "database.db")
 DB_FILE = os.environ.get("ROOMS_DB_PATH", DEFAULT_DB_FILE)
 
+# one room row as a JSON object, used to build list responses inside SQLite
+_ROOM_JSON = (
+    "json_object('id', id, 'name', name, 'capacity', capacity, "
+    "'equipment', equipment, 'location', location, 'status', status)"
+)
+
+# column order of every single-room query below, rows are turned into dicts
+# by position instead of dict(sqlite3.Row) which looks every key up by name
+ROOM_COLS = ("id", "name", "capacity", "equipment", "location", "status")
+_ROOM_COLS_SQL = ", ".join(ROOM_COLS)
+
+# fixed SQL text for the helpers below. the connection's statement cache is
+# keyed on the SQL string, so keeping one copy of each statement here means
+# every call after the first reuses the prepared statement.
+_SQL = {
+    "insert": f"""
+        insert into rooms (name, capacity, equipment, location, status)
+        values (?, ?, ?, ?, ?)
+        on conflict(name) do nothing
+        returning {_ROOM_COLS_SQL}
+    """,
+    "insert_bulk": """
+        insert into rooms (name, capacity, equipment, location, status)
+        values (?, ?, ?, ?, ?)
+    """,
+    "by_name": f"select {_ROOM_COLS_SQL} from rooms where name = ?",
+    "list_all": f"select json_group_array({_ROOM_JSON}) from rooms",
+    "update": f"""
+        update rooms
+        set capacity = coalesce(?, capacity),
+            equipment = coalesce(?, equipment),
+            location = coalesce(?, location),
+            status = coalesce(?, status)
+        where name = ?
+        returning {_ROOM_COLS_SQL}
+    """,
+    "delete": "delete from rooms where name = ? returning id",
+}
+
+
+def _room_dict(row):
+    """one room row (in ``ROOM_COLS`` order) as a dict, or ``None``."""
+    return dict(zip(ROOM_COLS, row)) if row else None
+
+
+# split the equipment text of every row in ``{rooms}`` into room_equipment rows.
+# json_quote escapes the text, so "a, b" becomes the JSON array ["a"," b"]
+_ROOM_EQUIPMENT_INSERT = """
+            insert or ignore into room_equipment (room_id, item)
+            select r.id, lower(trim(e.value))
+            from {rooms} as r,
+                 json_each('[' || replace(json_quote(r.equipment), ',', '","') || ']') as e
+            where trim(e.value) <> ''"""
+# ``{rooms}`` source for the triggers: just the row being written
+_NEW_ROOM = "(select new.id as id, new.equipment as equipment)"
+
+
+class _SharedConnection(sqlite3.Connection):
+    """connection that is shared by every caller on one thread.
+    ``close()`` is a no-op so old style ``conn.close()`` calls don't break the
+    next user, the real close happens at interpreter exit.
+    """
+
+    def close(self):
+        pass
+
+    def _really_close(self):
+        super().close()
+
+
+# one connection per thread, all of them closed by the atexit hook below
+_tls = threading.local()
+_all_conns = []
+_all_conns_lock = threading.Lock()
+
+
 def get_db_connection():
-    """open a connection to the rooms database and return it.
-    connection uses ``sqlite3.Row`` so we can access columns by name.
+    """return this thread's connection to the rooms database, opening it on first use.
+    connection uses ``sqlite3.Row`` so we can access columns by name, runs in
+    autocommit mode and uses WAL so reads don't wait on writers. reads go
+    through a 256MB memory map instead of read() copies; page_size only takes
+    effect when the database file is brand new, so it is set before WAL.
     """
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
+    conn = getattr(_tls, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(
+            DB_FILE,
+            factory=_SharedConnection,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.executescript(
+            "PRAGMA page_size=8192; "
+            "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; "
+            "PRAGMA temp_store=MEMORY; PRAGMA cache_size=-20000; "
+            "PRAGMA mmap_size=268435456;"
+        )
+        _tls.conn = conn
+        with _all_conns_lock:
+            _all_conns.append(conn)
     return conn
 
 
+@atexit.register
+def _close_all_connections():
+    with _all_conns_lock:
+        while _all_conns:
+            _all_conns.pop()._really_close()
+
 
 def make_rooms_table_if_missing():
     """create the ``rooms`` table if not already exist.
@@ -43,34 +148,110 @@ def make_rooms_table_if_missing():
         "create index if not exists idx_rooms_name on rooms(name);"
     )
 
-    conn.commit()
-    conn.close()
+    # availability search filters on status = ? and capacity >= ?
+    cur.execute(
+        "create index if not exists idx_rooms_status_capacity on rooms(status, capacity);"
+    )
+
+    # full-text index over rooms (external content), kept in sync by triggers,
+    # so the location filter is a token lookup instead of a LIKE scan
+    cur.execute("select 1 from sqlite_master where name = 'rooms_fts'")
+    fts_is_new = cur.fetchone() is None
+    cur.executescript(
+        """
+        create virtual table if not exists rooms_fts using fts5(
+            name, equipment, location, content='rooms', content_rowid='id'
+        );
 
+        create trigger if not exists rooms_fts_ai after insert on rooms begin
+            insert into rooms_fts(rowid, name, equipment, location)
+            values (new.id, new.name, new.equipment, new.location);
+        end;
+
+        create trigger if not exists rooms_fts_ad after delete on rooms begin
+            insert into rooms_fts(rooms_fts, rowid, name, equipment, location)
+            values ('delete', old.id, old.name, old.equipment, old.location);
+        end;
+
+        create trigger if not exists rooms_fts_au after update on rooms begin
+            insert into rooms_fts(rooms_fts, rowid, name, equipment, location)
+            values ('delete', old.id, old.name, old.equipment, old.location);
+            insert into rooms_fts(rowid, name, equipment, location)
+            values (new.id, new.name, new.equipment, new.location);
+        end;
+        """
+    )
+    if fts_is_new:
+        # index rooms that existed before the fts table did
+        cur.execute("insert into rooms_fts(rooms_fts) values ('rebuild')")
+
+    # one row per (room, equipment item), items trimmed and lower-cased.
+    # the comma separated ``rooms.equipment`` text stays the source of truth,
+    # the triggers split it (via json_each, CTEs are not allowed in triggers)
+    cur.execute("select 1 from sqlite_master where name = 'room_equipment'")
+    equipment_is_new = cur.fetchone() is None
+    cur.executescript(
+        f"""
+        create table if not exists room_equipment (
+            room_id integer not null,
+            item text not null,
+            primary key (room_id, item)
+        ) without rowid;
+
+        create index if not exists idx_room_equipment_item
+            on room_equipment(item, room_id);
+
+        create trigger if not exists room_equipment_ai after insert on rooms begin
+            {_ROOM_EQUIPMENT_INSERT.format(rooms=_NEW_ROOM)};
+        end;
+
+        create trigger if not exists room_equipment_ad after delete on rooms begin
+            delete from room_equipment where room_id = old.id;
+        end;
+
+        create trigger if not exists room_equipment_au
+        after update of equipment on rooms begin
+            delete from room_equipment where room_id = old.id;
+            {_ROOM_EQUIPMENT_INSERT.format(rooms=_NEW_ROOM)};
+        end;
+        """
+    )
+    if equipment_is_new:
+        # migrate equipment of rooms created before the table existed
+        cur.execute(_ROOM_EQUIPMENT_INSERT.format(rooms="rooms"))
 
 
 def insert_room(name, capacity, equipment, location, status="available"):
     """insert a new room and return it as a dict.
     it takes as parameters: name as in name of the room ( unique),capacity(max nb of ppl), equipment (comma separated list), location(floor, building etc), status(available/booked)
-    it returns newly inserted row as a dict, or ``None`` if something went wrong.
+    it returns newly inserted row as a dict, or ``None`` if a room with that name already exists.
     """
     conn = get_db_connection()
     cur = conn.cursor()
 
-    cur.execute(
-        """
-        insert into rooms (name, capacity, equipment, location, status)
-        values (?, ?, ?, ?, ?)
-        """,
-        (name, capacity, equipment, location, status),
-    )
-    conn.commit()
-    new_id = cur.lastrowid
-
-    cur.execute("select * from rooms where id = ?", (new_id,))
+    cur.execute(_SQL["insert"], (name, capacity, equipment, location, status))
     row = cur.fetchone()
 
-    conn.close()
-    return dict(row) if row else None
+    return _room_dict(row)
+
+
+def bulk_insert_rooms(rows):
+    """insert many rooms in one transaction, used for seeding (profiler, tests).
+    rows is a list of ``(name, capacity, equipment, location, status)`` tuples.
+    returns number of rows inserted.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    conn.execute("begin")
+    try:
+        cur.executemany(_SQL["insert_bulk"], rows)
+    except Exception:
+        conn.execute("rollback")
+        raise
+    conn.execute("commit")
+
+    return cur.rowcount
 
 
 def find_room_by_name(name):
@@ -78,49 +259,41 @@ def find_room_by_name(name):
     conn = get_db_connection()
     cur = conn.cursor()
 
-    cur.execute("select * from rooms where name = ?", (name,))
+    cur.execute(_SQL["by_name"], (name,))
     row = cur.fetchone()
 
-    conn.close()
-    return dict(row) if row else None
+    return _room_dict(row)
 
 
 def list_all_rooms():
-    """return all rooms as a list of dicts."""
+    """return all rooms as a JSON array string.
+    the array is built by SQLite itself so python only gets back one text value.
+    """
     conn = get_db_connection()
     logger.info("DB QUERY: list_all_rooms called")
     cur = conn.cursor()
 
-    cur.execute("select * from rooms")
-    rows = cur.fetchall()
+    cur.execute(_SQL["list_all"])
+    rooms_json = cur.fetchone()[0]
 
-    conn.close()
-    return [dict(r) for r in rows]
+    return rooms_json
 
 
-def update_room_row(name, new_capacity, new_equipment, new_location, new_status):
+def update_room_row(name, new_capacity=None, new_equipment=None, new_location=None, new_status=None):
     """update a room row and return the updated row. takes in as parameters: name of the room to update, new capacity, new equipment string, new location string, new status string.
+    any new value left as ``None`` keeps what is already stored, so callers don't have to read the row first.
     then returns Updated room row, or ``None`` if the room does not exist.
     """
     conn = get_db_connection()
     cur = conn.cursor()
 
     cur.execute(
-        """
-        update rooms
-        set capacity = ?, equipment = ?, location = ?, status = ?
-        where name = ?
-        """,
+        _SQL["update"],
         (new_capacity, new_equipment, new_location, new_status, name),
     )
-
-    conn.commit()
-
-    cur.execute("select * from rooms where name = ?", (name,))
     row = cur.fetchone()
 
-    conn.close()
-    return dict(row) if row else None
+    return _room_dict(row)
 
 
 def delete_room_row(name):
@@ -130,39 +303,71 @@ def delete_room_row(name):
     conn = get_db_connection()
     cur = conn.cursor()
 
-    cur.execute("delete from rooms where name = ?", (name,))
-    conn.commit()
-    rows_deleted = cur.rowcount
+    cur.execute(_SQL["delete"], (name,))
+    rows_deleted = len(cur.fetchall())
 
-    conn.close()
     return rows_deleted
 
 
+def _fts_terms(column, text):
+    """turn free user text into an FTS5 MATCH expression on one column.
+    every word becomes a quoted prefix term (so quotes, ``%`` and FTS operators
+    in the input are never interpreted), all of them must match.
+    returns ``None`` if the text has no word characters at all.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " AND ".join(f'{column}:"{w}"*' for w in words)
+
+
 def search_available_rooms(min_capacity=None, location=None, equipment_contains=None):
-    """searchs for available rooms with simple filters. the following filters are optional: min_capacity(rooms with capacity >= this value), location(substring that must appear in the location), equipment_contains(substring that must appear in the equipment).
-    Only rooms with status = "available" are returned.
+    """searchs for available rooms with simple filters. the following filters are optional: min_capacity(rooms with capacity >= this value), location(words that must appear in the location), equipment_contains(comma separated equipment items the room must all have).
+    location words are matched through the ``rooms_fts`` full-text index as word prefixes, e.g. "hamr" matches "Hamra".
+    equipment items are matched whole (case-insensitive) against ``room_equipment``, so "projector" does not match "non-projector".
+    Only rooms with status = "available" are returned, as a JSON array string.
     """
     conn = get_db_connection()
     logger.info("DB QUERY: search_available_rooms called") 
     cur = conn.cursor()
 
-    query = "select * from rooms where status = 'available'"
+    match_terms = _fts_terms("location", location) if location else None
+    if location and not match_terms:
+        # a location with no words in it (e.g. "---") can't match any room;
+        # don't drop the filter and return everything
+        return "[]"
+
+    equipment_items = []
+    if equipment_contains:
+        equipment_items = [
+            item.strip().lower() for item in equipment_contains.split(",") if item.strip()
+        ]
+        if not equipment_items:
+            # same for equipment made only of commas/blanks (e.g. ",")
+            return "[]"
+
+    query = "select rooms.* from rooms"
     params = []
+    if match_terms:
+        query += " join rooms_fts on rooms_fts.rowid = rooms.id"
+    query += " where rooms.status = 'available'"
 
     if min_capacity is not None:
-        query += " and capacity >= ?"
+        query += " and rooms.capacity >= ?"
         params.append(min_capacity)
 
-    if location:
-        query += " and location like ?"
-        params.append(f"%{location}%")
+    if match_terms:
+        query += " and rooms_fts match ?"
+        params.append(match_terms)
 
-    if equipment_contains:
-        query += " and equipment like ?"
-        params.append(f"%{equipment_contains}%")
+    for item in equipment_items:
+        query += (
+            " and rooms.id in"
+            " (select room_id from room_equipment where item = ?)"
+        )
+        params.append(item)
 
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    conn.close()
+    cur.execute(f"select json_group_array({_ROOM_JSON}) from ({query})", params)
+    rooms_json = cur.fetchone()[0]
 
-    return [dict(r) for r in rows]
+    return rooms_json
@@ -3,6 +3,10 @@ import sys
 sys.path.insert(0, os.path.dirname(__file__))  # make local database.py importable
 
 import json
+import sqlite3
+import threading
+import time
+import pytest
 import database
 from app import app
 
@@ -184,6 +188,121 @@ def test_get_available_rooms_filters_and_skips_booked():
     assert "TinyTaybe" not in names
 
 
+def test_get_available_rooms_location_and_equipment_words():
+    wipe_rooms_table()
+    client = app.test_client()
+    admin = {"X-User-Name": "adminuser", "X-User-Role": "admin"}
+    for body in (
+        {"name": "HamraHall", "capacity": 8, "equipment": "projector, whiteboard",
+         "location": "2nd floor - Hamra"},
+        {"name": "HamraNook", "capacity": 4, "equipment": "tv",
+         "location": "1st floor - Hamra"},
+        {"name": "ByblosBox", "capacity": 8, "equipment": "projector",
+         "location": "Byblos"},
+    ):
+        client.post("/rooms", data=json.dumps(body),
+                    content_type="application/json", headers=admin)
+
+    resp = client.get("/rooms/available?location=hamr&equipment_contains=Projector")
+    assert resp.status_code == 200
+    assert {r["name"] for r in resp.get_json()} == {"HamraHall"}
+
+    # equipment items match whole, not as substrings
+    resp = client.get("/rooms/available?equipment_contains=proj")
+    assert resp.get_json() == []
+    resp = client.get("/rooms/available?equipment_contains=whiteboard,%20projector")
+    assert {r["name"] for r in resp.get_json()} == {"HamraHall"}
+
+    # changed equipment is picked up by the index
+    client.put("/rooms/HamraNook", data=json.dumps({"equipment": "projector"}),
+               content_type="application/json", headers=admin)
+    resp = client.get("/rooms/available?location=hamra&equipment_contains=projector")
+    assert {r["name"] for r in resp.get_json()} == {"HamraHall", "HamraNook"}
+
+    # a location without any word characters matches nothing, not everything
+    resp = client.get("/rooms/available?location=---")
+    assert resp.status_code == 200
+    assert resp.get_json() == []
+
+    # same for an equipment list made only of commas and blanks
+    resp = client.get("/rooms/available?equipment_contains=,%20,")
+    assert resp.status_code == 200
+    assert resp.get_json() == []
+
+
+def test_bulk_insert_rooms_visible_in_listing():
+    wipe_rooms_table()
+    client = app.test_client()
+    inserted = database.bulk_insert_rooms(
+        [
+            ("BulkBeit", 4, "tv", "Hamra", "available"),
+            ("BulkDar", 9, "projector", "Verdun", "booked"),
+        ]
+    )
+    assert inserted == 2
+
+    import app as room_app
+    room_app.invalidate_rooms_cache()
+    resp = client.get("/rooms")
+    assert {r["name"] for r in resp.get_json()} == {"BulkBeit", "BulkDar"}
+
+
+def test_available_rooms_cache_is_bounded():
+    import app as room_app
+
+    wipe_rooms_table()
+    client = app.test_client()
+    room_app.invalidate_rooms_cache()
+    for cap in range(room_app.AVAILABLE_ROOMS_CACHE_SIZE + 20):
+        resp = client.get(f"/rooms/available?min_capacity={cap}")
+        assert resp.status_code == 200
+    assert len(room_app._available_rooms_cache) == room_app.AVAILABLE_ROOMS_CACHE_SIZE
+
+
+def test_available_rooms_hit_not_blocked_by_slow_miss(monkeypatch):
+    """a cached search is served while another key's DB query is still running."""
+    import app as room_app
+
+    wipe_rooms_table()
+    room_app.invalidate_rooms_cache()
+    cached = room_app.get_cached_available_rooms(equipment_contains="projector")
+
+    started, release = threading.Event(), threading.Event()
+
+    def slow_search(**filters):
+        started.set()
+        release.wait(5)
+        return "[]"
+
+    monkeypatch.setattr(room_app, "search_available_rooms", slow_search)
+    miss = threading.Thread(
+        target=room_app.get_cached_available_rooms, kwargs={"location": "slow"}
+    )
+    miss.start()
+    try:
+        assert started.wait(5)
+        t0 = time.monotonic()
+        assert room_app.get_cached_available_rooms(equipment_contains="projector") == cached
+        assert time.monotonic() - t0 < 1
+    finally:
+        release.set()
+        miss.join()
+
+
+def test_failed_refill_leaves_no_lock_behind(monkeypatch):
+    import app as room_app
+
+    room_app.invalidate_rooms_cache()
+
+    def broken_search(**filters):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(room_app, "search_available_rooms", broken_search)
+    with pytest.raises(sqlite3.OperationalError):
+        room_app.get_cached_available_rooms(location="broken")
+    assert room_app._refill_locks == {}
+
+
 def test_update_room_changes_capacity_and_status():
     wipe_rooms_table()
     client = app.test_client()
@@ -348,3 +467,101 @@ def test_create_room_forbidden_for_regular_user():
         headers={"X-User-Name": "nour", "X-User-Role": "regular"},
     )
     assert resp.status_code == 403
+
+
+def test_create_room_capacity_not_integer():
+    """capacity that isn't an integer (string or digit-like symbol) gives 400."""
+    wipe_rooms_table()
+    client = app.test_client()
+
+    for bad in ["ten", "²", "--5", "1" * 5000]:
+        body = {
+            "name": "BadCapacityRoom",
+            "capacity": bad,
+            "equipment": "projector",
+            "location": "2nd floor",
+            "status": "available",
+        }
+        resp = client.post(
+            "/rooms",
+            data=json.dumps(body),
+            content_type="application/json",
+            headers={"X-User-Name": "adminuser", "X-User-Role": "admin"},
+        )
+        assert resp.status_code == 400
+        assert resp.get_json()["error"] == "capacity must be an integer"
+
+
+def test_create_room_capacity_padded_string_accepted():
+    """a digit string with surrounding spaces still counts as an integer."""
+    wipe_rooms_table()
+    client = app.test_client()
+
+    body = {
+        "name": "PaddedCapacityRoom",
+        "capacity": " 5 ",
+        "equipment": "projector",
+        "location": "2nd floor",
+        "status": "available",
+    }
+    resp = client.post(
+        "/rooms",
+        data=json.dumps(body),
+        content_type="application/json",
+        headers={"X-User-Name": "adminuser", "X-User-Role": "admin"},
+    )
+    assert resp.status_code == 201
+    assert resp.get_json()["room"]["capacity"] == 5
+
+
+def test_create_room_invalid_json_body():
+    """a body that isn't valid JSON is a 400, not a server error."""
+    wipe_rooms_table()
+    client = app.test_client()
+
+    resp = client.post(
+        "/rooms",
+        data="{not json",
+        content_type="application/json",
+        headers={"X-User-Name": "adminuser", "X-User-Role": "admin"},
+    )
+    assert resp.status_code == 400
+    assert resp.get_json() == {"error": "bad request"}
+
+
+def test_update_room_without_fields_is_400():
+    """PUT with nothing to update is rejected before the room is looked up."""
+    wipe_rooms_table()
+    client = app.test_client()
+
+    resp = client.put(
+        "/rooms/NoSuchRoom",
+        data=json.dumps({"nickname": "x"}),
+        content_type="application/json",
+        headers={"X-User-Name": "adminuser", "X-User-Role": "admin"},
+    )
+    assert resp.status_code == 400
+    assert resp.get_json()["error"] == "empty body"
+
+
+def test_get_all_rooms_etag_not_modified():
+    """/rooms answers If-None-Match with 304 until a room changes."""
+    wipe_rooms_table()
+    client = app.test_client()
+    admin = {"X-User-Name": "adminuser", "X-User-Role": "admin"}
+    body = {"name": "EtagRoom", "capacity": 5, "equipment": "tv", "location": "Hamra"}
+    client.post("/rooms", data=json.dumps(body), content_type="application/json", headers=admin)
+
+    first = client.get("/rooms")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+
+    again = client.get("/rooms", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.data == b""
+
+    client.put("/rooms/EtagRoom", data=json.dumps({"capacity": 6}),
+               content_type="application/json", headers=admin)
+    changed = client.get("/rooms", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
@@ -2,15 +2,26 @@
 """ This part of the project exposes the HTTP endpoints for the users service. It takes care of  all direct database work to :mod:`database`  
 focuses on validation and shaping  the JSON responses. """
 import os
-from datetime import datetime, timedelta
+import sqlite3
+import atexit
+import hmac
+import hashlib
 import logging
+import logging.handlers
+import queue
 from flask_talisman import Talisman
 
 import jwt
-from flask import Flask, jsonify, request, g
-from werkzeug.security import generate_password_hash, check_password_hash
+import orjson
+from flask import Flask, Response, request, g
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from functools import wraps
+import threading
 import time  
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TLRUCache, TTLCache
 from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
 import sentry_sdk
@@ -36,7 +47,60 @@ class PrefixMiddleware:
 
 # ── Authentication config ────────────────────────────────────────────────
 AUTH_SECRET_KEY = os.environ.get("AUTH_SECRET_KEY", "dev-secret-key-change-me")
-TOKEN_EXP_MINUTES = 60  # 1 hour tokens
+TOKEN_EXP_SECONDS = 3600  # 1 hour tokens
+
+# argon2id for every new hash; hashes created before the switch are werkzeug
+# pbkdf2/scrypt strings and get upgraded the next time that user logs in
+_hasher = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=2)
+
+# hashing runs on a shared pool sized to the cores, so a login/register burst
+# can only keep that many hashes in flight and can't starve every request
+# thread. argon2 and hashlib both drop the GIL while they work
+HASH_POOL_SIZE = int(os.environ.get("HASH_POOL_SIZE", os.cpu_count() or 1))
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_POOL_SIZE, thread_name_prefix="pwhash")
+atexit.register(_hash_pool.shutdown, wait=False)
+
+
+def hash_password(raw_pass):
+    """Return an argon2id hash string for a plain password."""
+    return _hash_pool.submit(_hasher.hash, raw_pass).result()
+
+
+def verify_password(stored_hash, raw_pass):
+    """
+    Check a password against a stored hash (argon2 or legacy werkzeug).
+    Returns ``(ok, needs_rehash)``; ``needs_rehash`` is True when the password
+    is correct but the hash is legacy or uses older argon2 parameters.
+    """
+    return _hash_pool.submit(_verify_password, stored_hash, raw_pass).result()
+
+
+def _verify_password(stored_hash, raw_pass):
+    if not stored_hash.startswith("$argon2"):
+        ok = check_password_hash(stored_hash, raw_pass)
+        return ok, ok
+    try:
+        _hasher.verify(stored_hash, raw_pass)
+    except (VerificationError, InvalidHashError):
+        return False, False
+    return True, _hasher.check_needs_rehash(stored_hash)
+
+
+# checked against when the username doesn't exist, so an unknown user costs the
+# same hash work as a wrong password and the two can't be told apart by timing
+_DUMMY_HASH = hash_password("x" * 16)
+
+# decoded tokens, keyed on a blake2b digest of the token so the same token
+# is only HMAC-checked and JSON-parsed once per TOKEN_CACHE_TTL. each entry
+# expires at the token's own exp if that comes first.
+TOKEN_CACHE_TTL = 60  # seconds
+_token_cache = TLRUCache(
+    maxsize=50000,
+    ttu=lambda _key, value, _now: value[2],
+    timer=time.time,
+)
+_token_cache_lock = threading.Lock()
+
 
 def get_current_user():
     """
@@ -49,9 +113,14 @@ def get_current_user():
     auth_header = request.headers.get("Authorization", "")
     if auth_header.startswith("Bearer "):
         token = auth_header[7:]
+        token_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        with _token_cache_lock:
+            cached = _token_cache.get(token_key)
+        if cached is not None:
+            return cached[0], cached[1]
+
         try:
             payload = jwt.decode(token, AUTH_SECRET_KEY, algorithms=["HS256"])
-            return payload.get("username"), payload.get("role")
         except jwt.ExpiredSignatureError:
             # Token expired → treated as unauthenticated
             return None, None
@@ -59,6 +128,14 @@ def get_current_user():
             # Any other token error → unauthenticated
             return None, None
 
+        username, role = payload.get("username"), payload.get("role")
+        expires_at = time.time() + TOKEN_CACHE_TTL
+        if isinstance(payload.get("exp"), (int, float)):
+            expires_at = min(expires_at, payload["exp"])
+        with _token_cache_lock:
+            _token_cache[token_key] = (username, role, expires_at)
+        return username, role
+
 
     username = request.headers.get("X-User-Name")
     role = request.headers.get("X-User-Role")
@@ -71,7 +148,8 @@ def generate_auth_token(user_row):
     payload = {
         "username": user_row["username"],
         "role": user_row["role"],
-        "exp": datetime.utcnow() + timedelta(minutes=TOKEN_EXP_MINUTES),
+        # integer epoch seconds; PyJWT takes it as-is, no datetime arithmetic
+        "exp": int(time.time()) + TOKEN_EXP_SECONDS,
     }
     token = jwt.encode(payload, AUTH_SECRET_KEY, algorithm="HS256")
     # PyJWT may return bytes or str depending on version
@@ -80,27 +158,30 @@ def generate_auth_token(user_row):
     return token
 
 
+def _json_response(payload, status=200):
+    """JSON response encoded with orjson, which hands back bytes directly."""
+    return Response(orjson.dumps(payload), status=status, mimetype="application/json")
+
+
 def require_roles(*allowed_roles):
     """
     Decorator to ensure the current user has one of the allowed roles.
     Returns 401 if role missing, 403 if role not allowed.
     """
+    # built once per decorated view: hashed role set and the encoded 403 body
+    allowed = frozenset(allowed_roles)
+    forbidden_body = orjson.dumps(
+        {"error": "forbidden: requires one of roles: " + ", ".join(allowed_roles)}
+    )
+
     def decorator(view_func):
         @wraps(view_func)
         def wrapped(*args, **kwargs):
             username, role = get_current_user()
             if role is None:
-                return jsonify({"error": "missing X-User-Role header"}), 401
-            if role not in allowed_roles:
-                return (
-                    jsonify(
-                        {
-                            "error": "forbidden: requires one of roles: "
-                            + ", ".join(allowed_roles)
-                        }
-                    ),
-                    403,
-                )
+                return _json_response({"error": "missing X-User-Role header"}, 401)
+            if role not in allowed:
+                return Response(forbidden_body, status=403, mimetype="application/json")
             return view_func(*args, **kwargs)
         return wrapped
     return decorator
@@ -113,9 +194,14 @@ try:
         insert_user,
         find_user_by_username,
         find_user_by_email,
+        find_conflicting_user,
+        user_exists,
         list_all_users,
         update_user_row,
         delete_user_row,
+        set_password_hash,
+        list_all_users_sanitized,
+        find_user_sanitized,
     )
 except ImportError:
     # Import when running from inside users_service/ with: python app.py
@@ -124,42 +210,107 @@ except ImportError:
         insert_user,
         find_user_by_username,
         find_user_by_email,
+        find_conflicting_user,
+        user_exists,
         list_all_users,
         update_user_row,
         delete_user_row,
+        set_password_hash,
+        list_all_users_sanitized,
+        find_user_sanitized,
     )
 
+def _row_to_sanitized_dict(row):
+    """Turn a user ``sqlite3.Row`` into a dict without ``password_hash``, in one pass."""
+    return {k: row[k] for k in row.keys() if k != "password_hash"}
+
+
 USER_CACHE_TTL = 30.0  # seconds
-_user_cache = {}       # username -> (data_without_hash, expires_at)
+USER_CACHE_SIZE = 10000
+# username -> data_without_hash. bounded LRU, entries also expire after the
+# TTL. TTLCache is not thread-safe, every access holds _user_cache_lock.
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+_user_cache_lock = threading.RLock()
+
+# with REDIS_URL set (several gunicorn workers / containers) the cache lives in
+# Redis instead, so every worker sees the same entries and invalidations.
+# without it the in-process TTLCache above is used.
+# Redis being down is never fatal: reads fall back to the DB and a failed
+# invalidation is logged (the entry then just lives out its TTL)
+REDIS_URL = os.environ.get("REDIS_URL")
+_redis = None
+try:
+    from redis import RedisError
+except ImportError:  # redis is only required when REDIS_URL is set
+    class RedisError(Exception):
+        pass
+if REDIS_URL:
+    import redis
+    _redis = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+
+
+def _user_cache_key(username):
+    return f"user:{username}"
+
+
+def _cached_user_fast(username):
+    """Return the cached sanitized user dict, or None on a miss (no DB access)."""
+    if _redis is None:
+        with _user_cache_lock:
+            return _user_cache.get(username)
+    try:
+        raw = _redis.get(_user_cache_key(username))
+    except RedisError:
+        logger.exception("redis get failed for user %s, reading the DB", username)
+        return None
+    return None if raw is None else orjson.loads(raw)
 
 
 def get_cached_user(username):
     """Return sanitized user dict from cache or DB."""
-    now = time.time()
-    entry = _user_cache.get(username)
-    if entry is not None:
-        data, expires_at = entry
-        if expires_at > now:
-            return data
-        # expired -> drop it
-        _user_cache.pop(username, None)
+    user_dict = _cached_user_fast(username)
+    if user_dict is not None:
+        return user_dict
+    return _load_and_cache_user(username)
 
-    user_row = find_user_by_username(username)
-    if not user_row:
+
+def _load_and_cache_user(username):
+    """Cache-miss path: read the sanitized user from the DB and cache it."""
+    user_dict = find_user_sanitized(username)
+    if not user_dict:
         return None
 
-    user_dict = dict(user_row)
-    user_dict.pop("password_hash", None)
-    _user_cache[username] = (user_dict, now + USER_CACHE_TTL)
+    if _redis is not None:
+        try:
+            _redis.setex(_user_cache_key(username), int(USER_CACHE_TTL), orjson.dumps(user_dict))
+        except RedisError:
+            logger.exception("redis setex failed for user %s", username)
+    else:
+        with _user_cache_lock:
+            _user_cache[username] = user_dict
     return user_dict
 
 
 def invalidate_user_cache(username=None):
     """Clear cache for one user or for all users."""
-    if username is None:
-        _user_cache.clear()
-    else:
-        _user_cache.pop(username, None)
+    if _redis is not None:
+        try:
+            if username is None:
+                # only our own keys, the Redis db may be shared with other services
+                keys = list(_redis.scan_iter(match=_user_cache_key("*")))
+                if keys:
+                    _redis.delete(*keys)
+            else:
+                _redis.delete(_user_cache_key(username))
+        except RedisError:
+            logger.exception("redis invalidation failed for %s", username or "all users")
+        return
+
+    with _user_cache_lock:
+        if username is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(username, None)
 
 app = Flask(__name__)
 
@@ -176,10 +327,20 @@ logger = logging.getLogger("users_service")
 logger.setLevel(logging.INFO)
 
 if not logger.handlers:
+    # request threads only put records on a queue, one background listener
+    # thread does the actual file writes
     file_handler = logging.FileHandler(os.path.join(LOG_DIR, "users_service.log"))
     formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener = logging.handlers.QueueListener(
+        log_queue, file_handler, respect_handler_level=True
+    )
+    log_listener.start()
+    # stop() drains whatever is still queued before the process exits
+    atexit.register(log_listener.stop)
 @app.before_request
 def audit_request():
     try:
@@ -227,7 +388,7 @@ def register_user():
     needed = ["name", "username", "email", "password", "role"]
     missing = [x for x in needed if not data.get(x)]
     if missing:
-        return jsonify({"error": f"missing: {', '.join(missing)}"}), 400
+        return _json_response({"error": f"missing: {', '.join(missing)}"}, 400)
 
     name = data["name"]
     username = data["username"]
@@ -235,22 +396,29 @@ def register_user():
     role = data["role"]
     raw_pass = data["password"]
 
-    if find_user_by_username(username):
-        return jsonify({"error": "username already used"}), 400
+    username_taken, email_taken = find_conflicting_user(username, email)
+    if username_taken:
+        return _json_response({"error": "username already used"}, 400)
+    if email_taken:
+        return _json_response({"error": "email already used"}, 400)
 
-    if find_user_by_email(email):
-        return jsonify({"error": "email already used"}), 400
-
-    hashed_pass = generate_password_hash(raw_pass)
-    created = insert_user(name, username, email, role, hashed_pass)
+    hashed_pass = hash_password(raw_pass)
+    try:
+        created = insert_user(name, username, email, role, hashed_pass)
+    except sqlite3.IntegrityError:
+        # another request registered the same username/email meanwhile;
+        # the UNIQUE constraints caught it, report which one
+        username_taken, _ = find_conflicting_user(username, email)
+        field = "username" if username_taken else "email"
+        return _json_response({"error": f"{field} already used"}, 400)
 
     if not created:
-        return jsonify({"error": "could not create user"}), 500
+        return _json_response({"error": "could not create user"}, 500)
 
     # never send hash back
-    created.pop("password_hash", None)
+    created = _row_to_sanitized_dict(created)
     invalidate_user_cache(created["username"])  # <-- NEW (optional but ok)
-    return jsonify({"message": "user registered", "user": created}), 201
+    return _json_response({"message": "user registered", "user": created}, 201)
 
 
 @app.route("/users/login", methods=["POST"])
@@ -272,30 +440,31 @@ def login_user():
     password = data.get("password")
 
     if not username or not password:
-        return jsonify({"error": "username and password are required"}), 400
+        return _json_response({"error": "username and password are required"}, 400)
 
     user_row = find_user_by_username(username)
-    if not user_row:
-        return jsonify({"message": "invalid username or password"}), 401
 
-    stored_hash = user_row.get("password_hash")
-    if not check_password_hash(stored_hash, password):
-        return jsonify({"message": "invalid username or password"}), 401
+    # same path whether or not the user exists: always run one hash check
+    stored_hash = user_row["password_hash"] if user_row else _DUMMY_HASH
+    password_ok, needs_rehash = verify_password(stored_hash, password)
+    ok = password_ok and user_row is not None
+    if not hmac.compare_digest(b"a" if ok else b"b", b"a"):
+        return _json_response({"message": "invalid username or password"}, 401)
+
+    if needs_rehash:
+        # the plain password is only available here, so upgrade the hash now
+        set_password_hash(username, hash_password(password))
 
    
     token = generate_auth_token(user_row)
-    user_copy = dict(user_row)
-    user_copy.pop("password_hash", None)
-
-    return (
-        jsonify(
-            {
-                "message": "login successful",
-                "token": token,
-                "user": user_copy,
-            }
-        ),
-        200,
+    user_copy = _row_to_sanitized_dict(user_row)
+
+    return _json_response(
+        {
+            "message": "login successful",
+            "token": token,
+            "user": user_copy,
+        }
     )
 
 
@@ -305,43 +474,45 @@ def login_user():
 def get_all_users():
     """ retrieves all users from database, removes password hashes before returning.
     returns JSON list of user objects. """
-    all_people = list_all_users()
-    for u in all_people:
-        u.pop("password_hash", None)
-    return jsonify(all_people), 200
+    all_people = list_all_users_sanitized()
+    return _json_response(all_people)
 
 
 
+_PROFILE_VIEWER_ROLES = frozenset(("admin", "auditor"))
+
+
 @app.route("/users/<string:username>", methods=["GET"])
 def get_user_by_username_route(username):
     current_username, role = get_current_user()
     if role is None:
-        return jsonify({"error": "missing X-User-Role header"}), 401
+        return _json_response({"error": "missing X-User-Role header"}, 401)
     # admin/auditor can see anyone; others only themselves
-    if role not in ("admin", "auditor") and current_username != username:
-        return jsonify(
-            {"error": "forbidden: you can only view your own user profile"}
-        ), 403
+    if role not in _PROFILE_VIEWER_ROLES and current_username != username:
+        return _json_response(
+            {"error": "forbidden: you can only view your own user profile"}, 403
+        )
 
     """ retrieves a single user by username, removes password hash before returning.
     returns JSON user object if found with user data, 404 if not found if user doesn't even exist. """
-    user_data = get_cached_user(username)  # <-- NEW
+    # a warm cache entry is a single lookup; only a miss reads the DB
+    user_data = get_cached_user(username)
     if not user_data:
-        return jsonify({"error": "user not found"}), 404
+        return _json_response({"error": "user not found"}, 404)
 
-    return jsonify(user_data), 200
+    return _json_response(user_data)
 
 
 @app.route("/users/<string:username>", methods=["PUT"])
 def update_user(username):
     current_username, role = get_current_user()
     if role is None:
-        return jsonify({"error": "missing X-User-Role header"}), 401
+        return _json_response({"error": "missing X-User-Role header"}, 401)
     # admin can update anybody; others only themselves
     if role != "admin" and current_username != username:
-        return jsonify(
-            {"error": "forbidden: you can only update your own user"}
-        ), 403
+        return _json_response(
+            {"error": "forbidden: you can only update your own user"}, 403
+        )
 
     """ updates user profile info. 
     Expects JSON body with optional fields: name, email,role , password.(optional; if present, the password is updated)
@@ -350,74 +521,69 @@ def update_user(username):
     """
     data = request.get_json() or {}
 
-    existing = find_user_by_username(username)
-    if not existing:
-        return jsonify({"error": "user not found"}), 404
-
-    new_name = data.get("name", existing["name"])
-    new_email = data.get("email", existing["email"])
-    new_role = data.get("role", existing["role"])
-
+    # fields left out (or null) keep their stored value
     new_hash = None
     if data.get("password"):
-        new_hash = generate_password_hash(data["password"])
+        # check first: don't pay for an argon2 hash just to answer 404
+        if not user_exists(username):
+            return _json_response({"error": "user not found"}, 404)
+        new_hash = hash_password(data["password"])
 
-    updated = update_user_row(username, new_name, new_email, new_role, new_hash)
+    updated = update_user_row(
+        username, data.get("name"), data.get("email"), data.get("role"), new_hash
+    )
     if not updated:
-        return jsonify({"error": "could not update user"}), 500
+        return _json_response({"error": "user not found"}, 404)
 
-    updated.pop("password_hash", None)
+    updated = _row_to_sanitized_dict(updated)
     invalidate_user_cache(username)  # <-- NEW
-    return jsonify({"message": "user updated", "user": updated}), 200
+    return _json_response({"message": "user updated", "user": updated})
 
 
 @app.route("/users/<string:username>", methods=["DELETE"])
 def delete_user(username):
     current_username, role = get_current_user()
     if role is None:
-        return jsonify({"error": "missing X-User-Role header"}), 401
+        return _json_response({"error": "missing X-User-Role header"}, 401)
     if role != "admin":
-        return jsonify(
-            {"error": "forbidden: only admin can delete users"}
-        ), 403
+        return _json_response(
+            {"error": "forbidden: only admin can delete users"}, 403
+        )
     """ deletes a user by username as  parameter.
     returns Json with short confirmation message if deleted, 404 if user not found."""
-    existing = find_user_by_username(username)
-    if not existing:
-        return jsonify({"error": "user not found"}), 404
+    if not user_exists(username):
+        return _json_response({"error": "user not found"}, 404)
 
     rows_deleted = delete_user_row(username)
     if rows_deleted == 0:
-        return jsonify({"error": "nothing deleted"}), 500
+        return _json_response({"error": "nothing deleted"}, 500)
 
     invalidate_user_cache(username)  # <-- NEW
 
-    return jsonify({"message": f"user {username} deleted"}), 200
+    return _json_response({"message": f"user {username} deleted"})
 
 
 @app.route("/users/<string:username>/bookings", methods=["GET"])
 def get_user_bookings(username):
     current_username, role = get_current_user()
     if role is None:
-        return jsonify({"error": "missing X-User-Role header"}), 401
+        return _json_response({"error": "missing X-User-Role header"}, 401)
     # admin/facility_manager can view anyone; regular only themselves
     if role not in ("admin", "facility_manager") and current_username != username:
-        return jsonify(
-            {"error": "forbidden: you can only view your own bookings"}
-        ), 403
+        return _json_response(
+            {"error": "forbidden: you can only view your own bookings"}, 403
+        )
 
     """ reuturns a user's bookings history. this only checks that  user exists and returns empty
     list of bookings for now. it takes  username as parameters and returns json with  user data and a bookings list."""
-    existing = find_user_by_username(username)
+    existing = find_user_sanitized(username)
     if not existing:
-        return jsonify({"error": "user not found"}), 404
-
-    existing.pop("password_hash", None)
+        return _json_response({"error": "user not found"}, 404)
 
     # placeholder for now; later you can talk to bookings service
     fake_bookings_list = []
 
-    return jsonify({"user": existing, "bookings": fake_bookings_list}), 200
+    return _json_response({"user": existing, "bookings": fake_bookings_list})
 
 
 
@@ -431,17 +597,17 @@ def allow_metrics():
 @app.errorhandler(400)
 def handle_400(e):
     logger.warning(f"BadRequest: {str(e)}")
-    return jsonify({"error": "bad request"}), 400
+    return _json_response({"error": "bad request"}, 400)
 
 @app.errorhandler(401)
 def handle_401(e):
     logger.warning(f"Unauthorized: {str(e)}")
-    return jsonify({"error": "unauthorized"}), 401
+    return _json_response({"error": "unauthorized"}, 401)
 
 @app.errorhandler(403)
 def handle_403(e):
     logger.warning(f"Forbidden: {str(e)}")
-    return jsonify({"error": "forbidden"}), 403
+    return _json_response({"error": "forbidden"}, 403)
 
 @app.errorhandler(404)
 def handle_404(e):
@@ -449,21 +615,22 @@ def handle_404(e):
     logger.warning(f"NotFound: {str(e)}")
     if request.path == "/metrics":
         return e
-    return jsonify({"error": "not found"}), 404
+    return _json_response({"error": "not found"}, 404)
 
 @app.errorhandler(500)
 def handle_500(e):
     logger.error(f"Internal Server Error: {str(e)}")
-    return jsonify({"error": "internal server error"}), 500
+    return _json_response({"error": "internal server error"}, 500)
 
 # fallback for *any* other uncaught exception
 @app.errorhandler(Exception)
 def handle_generic(e):
     logger.exception("Unhandled exception in users_service")
-    return jsonify({"error": "internal server error"}), 500
+    return _json_response({"error": "internal server error"}, 500)
 
 
 if __name__ == "__main__":
     make_users_table_if_missing()
     port = int(os.environ.get("USERS_SERVICE_PORT", 5001))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    # local runs only; production goes through gunicorn + wsgi.py
+    app.run(host="0.0.0.0", port=port, debug=os.environ.get("FLASK_ENV") == "dev")
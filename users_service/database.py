@@ -4,49 +4,147 @@
 
 import sqlite3
 import os
+import atexit
+import threading
+from functools import lru_cache
 from datetime import datetime
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
 DEFAULT_DB_FILE = os.path.join(BASE_DIR, "database.db")
 
+# a plain path or a sqlite URI (e.g. "file:users?mode=memory&cache=shared")
 DB_FILE = os.environ.get("USERS_DB_PATH", DEFAULT_DB_FILE)
+
+
+# explicit column list for every user query. username/email lookups go
+# through the UNIQUE constraints' own indexes, picked by the planner
+USER_COLUMNS = "id, name, username, email, role, password_hash, created_at"
+# same without the password hash, for anything that goes back to a client
+PUBLIC_USER_COLUMNS = "id, name, username, email, role, created_at"
+
+# every statement the helpers run, written once. the per-thread connection's
+# statement cache (cached_statements) is keyed on this text, so after the
+# first call each one is reused already prepared.
+_STMTS = {
+    "insert": """
+        insert into users (name, username, email, role, password_hash, created_at)
+        values (?, ?, ?, ?, ?, ?)
+    """,
+    "find_by_id": f"select {USER_COLUMNS} from users where id = ?",
+    "find_by_username": (
+        f"select {USER_COLUMNS} from users where username = ?"
+    ),
+    "find_by_email": (
+        f"select {USER_COLUMNS} from users where email = ?"
+    ),
+    # OR over two indexed columns: SQLite answers it as a union of both index lookups
+    "find_conflicting": "select username, email from users where username = ? or email = ?",
+    "list_all": f"select {USER_COLUMNS} from users",
+    "list_all_sanitized": f"select {PUBLIC_USER_COLUMNS} from users",
+    "find_sanitized": (
+        f"select {PUBLIC_USER_COLUMNS} from users where username = ?"
+    ),
+    "exists": "select 1 from users where username = ? limit 1",
+    "set_password_hash": "update users set password_hash = ? where username = ?",
+    "delete": "delete from users where username = ?",
+}
+
+
+
+@lru_cache(maxsize=None)
+def _update_stmt(columns):
+    """UPDATE text setting only ``columns``; RETURNING hands back the updated
+    row (or nothing if the username doesn't exist) in the same step. At most 15
+    variants exist, each built once and then reused by the statement cache."""
+    assignments = ", ".join(f"{col} = ?" for col in columns)
+    return f"update users set {assignments} where username = ? returning {USER_COLUMNS}"
+
+
+# applied to every new connection (make_users_table_if_missing included)
+_CONNECTION_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-20000;
+    PRAGMA mmap_size=268435456;
+"""
+
+# one connection per thread, all of them closed by the atexit hook below
+_tls = threading.local()
+_all_conns = []
+_all_conns_lock = threading.Lock()
+
+
 def get_db_connection():
-    """open a connection to the users database and return it.
-    connection uses ``sqlite3.Row`` so we can access columns by name.
+    """Return this thread's connection to the users database.
+
+    the connection is opened on first use and then reused (callers must not
+    close it, the atexit hook does that), it runs in
+    autocommit mode and uses ``sqlite3.Row`` so we can access columns by name.
+    WAL with ``synchronous=NORMAL`` means writes don't fsync every commit and
+    don't block readers; reads go through a 256MB memory map.
     """
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
+    conn = getattr(_tls, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(
+            DB_FILE,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=128,
+            uri=True,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.executescript(_CONNECTION_PRAGMAS)
+        _tls.conn = conn
+        with _all_conns_lock:
+            _all_conns.append(conn)
     return conn
 
 
+@atexit.register
+def _close_all_connections():
+    with _all_conns_lock:
+        while _all_conns:
+            _all_conns.pop().close()
+
+
 def make_users_table_if_missing():
     """Create the ``users`` table if it does not already exist.
 
     just called once at startup so the rest of the code can assume  that the table is there and ready to use.
+    the create runs in its own transaction; if the caller already opened one,
+    it just joins it.
     """
     conn = get_db_connection()
     cur = conn.cursor()
 
-    cur.execute(
-        """
-        create table if not exists users (
-            id integer primary key autoincrement,
-            name text not null,
-            username text not null unique,
-            email text not null unique,
-            role text not null,
-            password_hash text not null,
-            created_at text not null
-        );
-        """
-    )
-
-    conn.commit()
-    conn.close()
+    owns_transaction = not conn.in_transaction
+    if owns_transaction:
+        conn.execute("begin")
+    try:
+        cur.execute(
+            """
+            create table if not exists users (
+                id integer primary key autoincrement,
+                name text not null,
+                username text not null unique,
+                email text not null unique,
+                role text not null,
+                password_hash text not null,
+                created_at text not null
+            );
+            """
+        )
+    except Exception:
+        if owns_transaction:
+            conn.execute("rollback")
+        raise
+    if owns_transaction:
+        conn.execute("commit")
 
 
 def insert_user(name, username, email, role, password_hash):
-    """Insert a new user row and return it as a dict.
+    """Insert a new user row and return it as a ``sqlite3.Row``.
     it takes  as parameters:
     name : str
         Full name of the user.
@@ -59,7 +157,7 @@ def insert_user(name, username, email, role, password_hash):
     password_hash : str
         Hashed password, already processed by the caller.
     Returns
-    The newly inserted row as a dict, or ``None`` if something went wrong.
+    The newly inserted row as a ``sqlite3.Row``, or ``None`` if something went wrong.
     """
     conn = get_db_connection()
     cur = conn.cursor()
@@ -67,20 +165,15 @@ def insert_user(name, username, email, role, password_hash):
     when_str = datetime.utcnow().isoformat()
 
     cur.execute(
-        """
-        insert into users (name, username, email, role, password_hash, created_at)
-        values (?, ?, ?, ?, ?, ?)
-        """,
+        _STMTS["insert"],
         (name, username, email, role, password_hash, when_str),
     )
-    conn.commit()
     new_id = cur.lastrowid
 
-    cur.execute("select * from users where id = ?", (new_id,))
+    cur.execute(_STMTS["find_by_id"], (new_id,))
     row = cur.fetchone()
 
-    conn.close()
-    return dict(row) if row else None
+    return row
 
 def find_user_by_username(username):
     """Look up one user by username.
@@ -88,16 +181,15 @@ def find_user_by_username(username):
     username : str
         Username to search for.
     Returns
-     Matching user row as a dict, or ``None`` if not found.
+     Matching user row as a ``sqlite3.Row``, or ``None`` if not found.
     """
     conn = get_db_connection()
     cur = conn.cursor()
 
-    cur.execute("select * from users where username = ?", (username,))
+    cur.execute(_STMTS["find_by_username"], (username,))
     row = cur.fetchone()
 
-    conn.close()
-    return dict(row) if row else None
+    return row
 
 def find_user_by_email(email):
     """Look up one user by email address.
@@ -105,14 +197,47 @@ def find_user_by_email(email):
     email : str
         Email address to search for.
     Returns
-        Matching user row as a dict, or ``None`` if not found.
+        Matching user row as a ``sqlite3.Row``, or ``None`` if not found.
     """
     conn = get_db_connection()
     cur = conn.cursor()
-    cur.execute("select * from users where email = ?", (email,))
+    cur.execute(_STMTS["find_by_email"], (email,))
     row = cur.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    return row
+
+
+def user_exists(username):
+    """Tell whether a username exists, without materializing the row.
+    takes as parameters:
+    username : str
+        Username to check.
+    Returns
+        ``True`` if a user with that username exists, otherwise ``False``.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(_STMTS["exists"], (username,))
+    return cur.fetchone() is not None
+
+
+def find_conflicting_user(username, email):
+    """Check whether a username or an email is already taken, in one query.
+    takes as parameters:
+    username : str
+        Username about to be registered.
+    email : str
+        Email address about to be registered.
+    Returns
+        ``(username_taken, email_taken)`` as two bools.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(_STMTS["find_conflicting"], (username, email))
+    username_taken = email_taken = False
+    for taken_username, taken_email in cur.fetchall():
+        username_taken = username_taken or taken_username == username
+        email_taken = email_taken or taken_email == email
+    return username_taken, email_taken
 
 
 def list_all_users():
@@ -120,54 +245,96 @@ def list_all_users():
     conn = get_db_connection()
     cur = conn.cursor()
 
-    cur.execute("select * from users")
+    cur.execute(_STMTS["list_all"])
     rows = cur.fetchall()
 
-    conn.close()
     return [dict(r) for r in rows]
 
 
+def list_all_users_sanitized():
+    """Return all users as a list of dicts without the ``password_hash`` column.
+    the hash is left out by the query itself so it never leaves SQLite.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    cur.execute(_STMTS["list_all_sanitized"])
+    rows = cur.fetchall()
+
+    return [dict(r) for r in rows]
+
+
+def find_user_sanitized(username):
+    """Look up one user by username, without the ``password_hash`` column.
+    takes as parameters
+    username : str
+        Username to search for.
+    Returns
+     Matching user row as a dict, or ``None`` if not found.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    cur.execute(_STMTS["find_sanitized"], (username,))
+    row = cur.fetchone()
+
+    return dict(row) if row else None
+
+
 def update_user_row(username, new_name, new_email, new_role, new_password_hash=None):
     """Update a user row and return the updated row.
     takes as parameters
     username : str
         Username of the user to update.
-    new_name : str
-        New name to store.
-    new_email : str
-        New email to store.
-    new_role : str
-        New role to store.
+    new_name : str, optional
+        New name to store. If ``None``, the name is not changed.
+    new_email : str, optional
+        New email to store. If ``None``, the email is not changed.
+    new_role : str, optional
+        New role to store. If ``None``, the role is not changed.
     new_password_hash : str, optional
         New hashed password. If ``None``, the password is not changed.
 
     Returns
-        Updated user row as a dict, or ``None`` if something went wrong.
+        Updated user row as a ``sqlite3.Row``, or ``None`` if no user has that username.
     """
     conn = get_db_connection()
     cur = conn.cursor()
 
-    cur.execute(
-        """
-        update users
-        set name = ?, email = ?, role = ?
-        where username = ?
-        """,
-        (new_name, new_email, new_role, username),
+    fields = (
+        ("name", new_name),
+        ("email", new_email),
+        ("role", new_role),
+        ("password_hash", new_password_hash),
     )
+    columns = tuple(col for col, value in fields if value is not None)
+    if not columns:
+        cur.execute(_STMTS["find_by_username"], (username,))
+        return cur.fetchone()
+
+    # one statement: only the changed columns, the existence check and the
+    # read-back, so e.g. a role change never re-checks the email UNIQUE index
+    params = [value for _, value in fields if value is not None]
+    params.append(username)
+    cur.execute(_update_stmt(columns), params)
+    row = cur.fetchone()
+    return row
 
-    # only touch the password if a new hash was provided
-    if new_password_hash is not None:
-        cur.execute(
-            "update users set password_hash = ? where username = ?",
-            (new_password_hash, username),
-        )
-    conn.commit()
 
-    cur.execute("select * from users where username = ?", (username,))
-    row = cur.fetchone()
-    conn.close()
-    return dict(row) if row else None
+def set_password_hash(username, password_hash):
+    """Replace only the stored password hash of a user.
+    takes as parameters
+    username : str
+        Username of the user.
+    password_hash : str
+        New hashed password.
+    Returns
+    Number of rows updated (0 if nothing matched).
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+    cur.execute(_STMTS["set_password_hash"], (password_hash, username))
+    return cur.rowcount
 
 
 def delete_user_row(username):
@@ -181,9 +348,54 @@ def delete_user_row(username):
     conn = get_db_connection()
     cur = conn.cursor()
 
-    cur.execute("delete from users where username = ?", (username,))
-    conn.commit()
+    cur.execute(_STMTS["delete"], (username,))
     rows_deleted = cur.rowcount
 
-    conn.close()
     return rows_deleted
+
+
+def delete_user_rows(usernames):
+    """Delete many users in one transaction.
+    takes as parameters
+    usernames : iterable of str
+        Usernames of the users to remove.
+    Returns
+    Number of rows deleted.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    conn.execute("begin")
+    try:
+        cur.executemany(_STMTS["delete"], ((u,) for u in usernames))
+    except Exception:
+        conn.execute("rollback")
+        raise
+    conn.execute("commit")
+
+    return cur.rowcount
+
+
+def bulk_insert_users(rows):
+    """Insert many users in one transaction, used for seeding (profiler, tests).
+    takes as parameters
+    rows : iterable of tuples
+        ``(name, username, email, role, password_hash)`` per user, the hash
+        already processed by the caller.
+    Returns
+    Number of rows inserted.
+    """
+    conn = get_db_connection()
+    cur = conn.cursor()
+
+    when_str = datetime.utcnow().isoformat()
+
+    conn.execute("begin")
+    try:
+        cur.executemany(_STMTS["insert"], (row + (when_str,) for row in rows))
+    except Exception:
+        conn.execute("rollback")
+        raise
+    conn.execute("commit")
+
+    return cur.rowcount
@@ -1,10 +1,53 @@
-import json
 import os
 import sys
+import orjson
+import pytest
 sys.path.insert(0, os.path.dirname(__file__))  # make local database.py importable
 
-import database
+# tests run against a private shared-cache in-memory db: no disk I/O and the
+# shared database.db is left alone. under pytest-xdist (pytest -n auto) every
+# worker is its own process, so each gets its own db and one worker's
+# clean_users_table never wipes rows another worker's test is using.
+# has to happen before database is imported, DB_FILE is read at import time
+os.environ.setdefault("USERS_DB_PATH", "file:users_test?mode=memory&cache=shared")
+
 from app import app
+
+# same import order as app.py, so this is the very module object the app uses
+# (a plain "import database" would be a second copy under another name, with
+# its own per-thread connection that PRAGMAs set here would never reach)
+try:
+    from users_service import database
+except ImportError:
+    import database
+
+
+# one test client for the whole module. RBAC identity travels in per-request
+# headers and the users app never sets a cookie, so the client carries no
+# state from one test to the next
+CLIENT = app.test_client()
+
+
+# every register body has these keys; a test only fills in its own values
+_REG_TEMPLATE = {
+    "name": None,
+    "username": None,
+    "email": None,
+    "password": "secret",
+    "role": "regular",
+}
+
+
+def _dump(body):
+    """Encode a request body to JSON bytes (the test client takes bytes for ``data=``)."""
+    return orjson.dumps(body)
+
+
+def _json(response):
+    """Decode a JSON response body with orjson."""
+    return orjson.loads(response.data)
+
+
 #old version which gave me less coverage
 #def clean_users_table():
 
@@ -13,43 +56,50 @@ from app import app
    # cur.execute("delete from users")
    # conn.commit()
    # conn.close()
-def clean_users_table():
-    """Clear the users table before each test and make sure it exists."""
+@pytest.fixture(scope="session")
+def db_conn():
+    """One connection for the whole run, with the users table in place."""
     # make_users_table_if_missing gets covered here
     database.make_users_table_if_missing()
 
+    # this thread's cached connection; the test client runs requests on this
+    # thread, so it's also the connection the app's writes go through. it
+    # stays open until interpreter exit, so there's nothing to close here
     conn = database.get_db_connection()
-    cur = conn.cursor()
-    cur.execute("delete from users")
-    conn.commit()
-    conn.close()
+    # test data doesn't need to survive a crash: skip the fsync on every commit
+    # (only matters when USERS_DB_PATH points the run at a real file)
+    conn.execute("PRAGMA synchronous=OFF")
+    yield conn
+
+
+@pytest.fixture(autouse=True)
+def clean_users_table(db_conn):
+    """Clear the users table before each test."""
+    db_conn.execute("delete from users")  # autocommit, no commit() needed
+
 
 def test_register_user_success():
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
-    register_body = {
+    register_body = _REG_TEMPLATE | {
         "name": "test user",
         "username": "testuser",
         "email": "test@example.com",
-        "password": "secret",
-        "role": "regular",
     }
 
     response = client.post(
         "/users/register",
-        data=json.dumps(register_body),
+        data=_dump(register_body),
         content_type="application/json",
     )
 
     assert response.status_code == 201
-    data = response.get_json()
+    data = _json(response)
     assert data["message"] == "user registered"
     assert data["user"]["username"] == "testuser"
 
 def test_register_user_missing_field():
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
     register_body = {
         "username": "nouna",
@@ -60,40 +110,39 @@ def test_register_user_missing_field():
 
     response = client.post(
         "/users/register",
-        data=json.dumps(register_body),
+        data=_dump(register_body),
         content_type="application/json",
     )
 
     assert response.status_code == 400
-    data = response.get_json()
+    data = _json(response)
     assert "missing" in data["error"]
 
 def test_login_success():
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
-    register_body = {
+    register_body = _REG_TEMPLATE | {
         "name": "riwa",
-               "username": "roro",
+        "username": "roro",
         "email": "riro@example.com",
         "password": "RORARI",
         "role": "admin",
     }
     client.post(
         "/users/register",
-        data=json.dumps(register_body),
+        data=_dump(register_body),
         content_type="application/json",
     )
 
     login_body = {"username": "roro", "password": "RORARI"}
     response = client.post(
         "/users/login",
-        data=json.dumps(login_body),
+        data=_dump(login_body),
         content_type="application/json",
     )
 
     assert response.status_code == 200
-    data = response.get_json()
+    data = _json(response)
     assert data["message"] == "login successful"
     assert "token" in data
     assert isinstance(data["token"], str)
@@ -104,10 +153,9 @@ def test_login_success():
 
 
 def test_login_wrong_password():
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
-    register_body = {
+    register_body = _REG_TEMPLATE | {
         "name": "Tala",
         "username": "touti",
         "email": "taltol@example.com",
@@ -116,31 +164,62 @@ def test_login_wrong_password():
     }
     client.post(
         "/users/register",
-        data=json.dumps(register_body),
+        data=_dump(register_body),
         content_type="application/json",
     )
 
     login_body = {"username": "touti", "password": "wrong"}
     response = client.post(
         "/users/login",
-        data=json.dumps(login_body),
+        data=_dump(login_body),
         content_type="application/json",
     )
 
     assert response.status_code == 401
 
+
+def test_login_unknown_user_same_response_as_wrong_password():
+    client = CLIENT
+
+    response = client.post(
+        "/users/login",
+        data=_dump({"username": "nobody", "password": "whatever"}),
+        content_type="application/json",
+    )
+
+    assert response.status_code == 401
+    assert _json(response) == {"message": "invalid username or password"}
+
+
+def test_login_upgrades_legacy_werkzeug_hash():
+    from werkzeug.security import generate_password_hash
+
+    client = CLIENT
+    database.insert_user(
+        "old timer", "oldie", "oldie@example.com", "regular",
+        generate_password_hash("legacy-pass"),
+    )
+
+    response = client.post(
+        "/users/login",
+        data=_dump({"username": "oldie", "password": "legacy-pass"}),
+        content_type="application/json",
+    )
+
+    assert response.status_code == 200
+    assert database.find_user_by_username("oldie")["password_hash"].startswith("$argon2id$")
+
+
 def test_get_all_users_returns_list():
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
-    first = {
+    first = _REG_TEMPLATE | {
         "name": "nour",
         "username": "nour",
         "email": "nour@example.com",
         "password": "abc123",
-        "role": "regular",
     }
-    second = {
+    second = _REG_TEMPLATE | {
         "name": "hadi",
         "username": "hadi",
         "email": "hadi@example.com",
@@ -148,33 +227,31 @@ def test_get_all_users_returns_list():
         "role": "admin",
     }
 
-    client.post("/users/register", data=json.dumps(first), content_type="application/json")
-    client.post("/users/register", data=json.dumps(second), content_type="application/json")
+    client.post("/users/register", data=_dump(first), content_type="application/json")
+    client.post("/users/register", data=_dump(second), content_type="application/json")
 
     response = client.get(
     "/users",
     headers={"X-User-Name": "hadi", "X-User-Role": "admin"},
 )
     assert response.status_code == 200
-    data = response.get_json()
+    data = _json(response)
     usernames = {u["username"] for u in data}
     assert "nour" in usernames
     assert "hadi" in usernames
 
 def test_get_user_by_username_found_and_not_found():
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
-    user_body = {
+    user_body = _REG_TEMPLATE | {
         "name": "someone",
         "username": "somebody",
         "email": "somebody@example.com",
         "password": "pwd",
-        "role": "regular",
     }
     client.post(
         "/users/register",
-        data=json.dumps(user_body),
+        data=_dump(user_body),
         content_type="application/json",
     )
 
@@ -183,7 +260,7 @@ def test_get_user_by_username_found_and_not_found():
     headers={"X-User-Name": "somebody", "X-User-Role": "regular"},
 )
     assert resp_ok.status_code == 200
-    data_ok = resp_ok.get_json()
+    data_ok = _json(resp_ok)
     assert data_ok["username"] == "somebody"
 
     resp_missing = client.get(
@@ -193,19 +270,17 @@ def test_get_user_by_username_found_and_not_found():
     assert resp_missing.status_code == 404
 
 def test_update_user_changes_email_and_role():
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
-    register_body = {
+    register_body = _REG_TEMPLATE | {
         "name": "update me",
         "username": "upuser",
         "email": "old@example.com",
         "password": "pass",
-        "role": "regular",
     }
     client.post(
         "/users/register",
-        data=json.dumps(register_body),
+        data=_dump(register_body),
         content_type="application/json",
     )
 
@@ -215,31 +290,29 @@ def test_update_user_changes_email_and_role():
     }
     response = client.put(
     "/users/upuser",
-    data=json.dumps(update_body),
+    data=_dump(update_body),
     content_type="application/json",
     headers={"X-User-Name": "upuser", "X-User-Role": "regular"},
 )
 
 
     assert response.status_code == 200
-    data = response.get_json()
+    data = _json(response)
     assert data["user"]["email"] == "new@example.com"
     assert data["user"]["role"] == "admin"
 
 def test_delete_user_removes_them():
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
-    register_body = {
+    register_body = _REG_TEMPLATE | {
         "name": "delete me",
         "username": "delme",
         "email": "del@example.com",
         "password": "pass",
-        "role": "regular",
     }
     client.post(
         "/users/register",
-        data=json.dumps(register_body),
+        data=_dump(register_body),
         content_type="application/json",
     )
 
@@ -256,42 +329,38 @@ def test_delete_user_removes_them():
     assert resp_after.status_code == 404
 
 def test_get_user_bookings_returns_empty_list():
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
-    register_body = {
+    register_body = _REG_TEMPLATE | {
         "name": "booker",
         "username": "booker",
         "email": "booker@example.com",
         "password": "pass",
-        "role": "regular",
     }
     client.post(
         "/users/register",
-        data=json.dumps(register_body),
+        data=_dump(register_body),
         content_type="application/json",
     )
 def test_register_user_duplicate_username():
     """Try registering the same username twice and expect a 400 on the second time."""
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
-    body = {
+    body = _REG_TEMPLATE | {
         "name": "nour",
         "username": "nour",
         "email": "nour@example.com",
         "password": "abc123",
-        "role": "regular",
     }
     # first register should be ok
     client.post(
         "/users/register",
-        data=json.dumps(body),
+        data=_dump(body),
         content_type="application/json",
     )
 
     # second register with same username should fail
-    body2 = {
+    body2 = _REG_TEMPLATE | {
         "name": "nour again",
         "username": "nour",  # same username
         "email": "other@example.com",
@@ -300,48 +369,63 @@ def test_register_user_duplicate_username():
     }
     resp = client.post(
         "/users/register",
-        data=json.dumps(body2),
+        data=_dump(body2),
         content_type="application/json",
     )
 
     assert resp.status_code == 400
-    data = resp.get_json()
+    data = _json(resp)
     assert "username already used" in data["error"]
     
 
 def test_login_missing_fields():
     """call login without password and expect a 400 error."""
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
     resp = client.post(
         "/users/login",
-        data=json.dumps({"username": "someone"}),  # missing password
+        data=_dump({"username": "someone"}),  # missing password
         content_type="application/json",
     )
 
     assert resp.status_code == 400
-    data = resp.get_json()
+    data = _json(resp)
     assert "username and password are required" in data["error"]
 
 def test_update_user_not_found():
     """try update a user that does not exist and expect 404."""
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
     body = {"email": "doesnt@exist.com"}
     resp = client.put(
     "/users/not_there",
-    data=json.dumps(body),
+    data=_dump(body),
     content_type="application/json",
     headers={"X-User-Name": "adminuser", "X-User-Role": "admin"},
 )
 
     assert resp.status_code == 404
+
+
+def test_update_missing_user_with_password_skips_hashing(monkeypatch):
+    """a password update for a missing user is a 404 before any hashing."""
+    users_app = sys.modules[app.import_name]
+
+    def no_hash(password):
+        raise AssertionError("hashed a password for a missing user")
+
+    monkeypatch.setattr(users_app, "hash_password", no_hash)
+    resp = CLIENT.put(
+        "/users/not_there",
+        data=_dump({"password": "newsecret"}),
+        content_type="application/json",
+        headers={"X-User-Name": "not_there", "X-User-Role": "regular"},
+    )
+
+    assert resp.status_code == 404
 def test_delete_user_not_found():
     """try deleting a non-existing user and expect 404."""
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
     resp = client.delete(
     "/users/ghost",
@@ -351,8 +435,7 @@ def test_delete_user_not_found():
     assert resp.status_code == 404
 def test_get_user_bookings_user_not_found():
     """ask for bookings of a non-existing user and expect 404."""
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
     resp = client.get(
     "/users/ghost/bookings",
@@ -360,19 +443,17 @@ def test_get_user_bookings_user_not_found():
 )
     assert resp.status_code == 404
 def test_get_all_users_forbidden_for_regular():
-    clean_users_table()
-    client = app.test_client()
+    client = CLIENT
 
-    body = {
+    body = _REG_TEMPLATE | {
         "name": "user1",
         "username": "user1",
         "email": "user1@example.com",
         "password": "pwd",
-        "role": "regular",
     }
     client.post(
         "/users/register",
-        data=json.dumps(body),
+        data=_dump(body),
         content_type="application/json",
     )
 
@@ -381,3 +462,147 @@ def test_get_all_users_forbidden_for_regular():
         headers={"X-User-Name": "user1", "X-User-Role": "regular"},
     )
     assert resp.status_code == 403
+
+
+def test_delete_user_rows_bulk():
+    for i in range(3):
+        database.insert_user(f"bulk {i}", f"bulk{i}", f"bulk{i}@example.com", "regular", "x")
+
+    assert database.delete_user_rows(["bulk0", "bulk2", "nobody"]) == 2
+    assert [u["username"] for u in database.list_all_users()] == ["bulk1"]
+
+
+def test_bulk_insert_users():
+    rows = [(f"seed {i}", f"seed{i}", f"seed{i}@example.com", "regular", "x") for i in range(3)]
+
+    assert database.bulk_insert_users(rows) == 3
+    assert [u["username"] for u in database.list_all_users()] == ["seed0", "seed1", "seed2"]
+
+
+def test_find_conflicting_user_reports_each_field():
+    database.insert_user("a", "alice", "alice@example.com", "regular", "x")
+    database.insert_user("b", "bob", "bob@example.com", "regular", "x")
+
+    assert database.find_conflicting_user("alice", "new@example.com") == (True, False)
+    assert database.find_conflicting_user("new", "bob@example.com") == (False, True)
+    assert database.find_conflicting_user("alice", "bob@example.com") == (True, True)
+    assert database.find_conflicting_user("new", "new@example.com") == (False, False)
+
+
+def test_user_exists_and_update_returning():
+    database.insert_user("a", "alice", "alice@example.com", "regular", "x")
+
+    assert database.user_exists("alice") is True
+    assert database.user_exists("nobody") is False
+
+    row = database.update_user_row("alice", None, "new@example.com", None)
+    assert (row["name"], row["email"], row["password_hash"]) == ("a", "new@example.com", "x")
+    assert database.update_user_row("nobody", "n", None, None) is None
+
+
+def test_bearer_token_identity_is_reused():
+    from app import _token_cache
+
+    client = CLIENT
+    client.post(
+        "/users/register",
+        data=_dump({"name": "tok", "username": "tok", "email": "tok@example.com",
+                         "password": "pw", "role": "regular"}),
+        content_type="application/json",
+    )
+    login = client.post(
+        "/users/login",
+        data=_dump({"username": "tok", "password": "pw"}),
+        content_type="application/json",
+    )
+    token = _json(login)["token"]
+
+    headers = {"Authorization": f"Bearer {token}"}
+    for _ in range(2):
+        resp = client.get("/users/tok", headers=headers)
+        assert resp.status_code == 200
+        assert _json(resp)["username"] == "tok"
+    assert len(_token_cache) >= 1
+
+    # a tampered token is still rejected
+    resp = client.get("/users/tok", headers={"Authorization": f"Bearer {token}x"})
+    assert resp.status_code == 401
+
+
+class _StubRedis:
+    """just enough of redis.Redis for the profile cache; fail=True acts like
+    a Redis that's down."""
+
+    def __init__(self, fail=False):
+        self.store = {}
+        self.fail = fail
+
+    def _check(self):
+        if self.fail:
+            from app import RedisError
+            raise RedisError("redis is down")
+
+    def get(self, key):
+        self._check()
+        return self.store.get(key)
+
+    def setex(self, key, ttl, value):
+        self._check()
+        self.store[key] = value.decode() if isinstance(value, bytes) else value
+
+    def delete(self, *keys):
+        self._check()
+        for key in keys:
+            self.store.pop(key, None)
+
+    def scan_iter(self, match):
+        self._check()
+        prefix = match.rstrip("*")
+        return [k for k in list(self.store) if k.startswith(prefix)]
+
+
+def _register_profile_user(client):
+    client.post(
+        "/users/register",
+        data=_dump(_REG_TEMPLATE | {"name": "red", "username": "red", "email": "red@example.com"}),
+        content_type="application/json",
+    )
+    return {"X-User-Name": "red", "X-User-Role": "regular"}
+
+
+def test_profile_cache_in_redis_miss_then_hit(monkeypatch):
+    users_app = sys.modules[app.import_name]
+    stub = _StubRedis()
+    monkeypatch.setattr(users_app, "_redis", stub)
+    headers = _register_profile_user(CLIENT)
+
+    # miss: read from the DB and stored in Redis
+    resp = CLIENT.get("/users/red", headers=headers)
+    assert resp.status_code == 200
+    assert orjson.loads(stub.store["user:red"])["email"] == "red@example.com"
+
+    # hit: served from Redis without touching the DB
+    stub.store["user:red"] = orjson.dumps(
+        orjson.loads(stub.store["user:red"]) | {"name": "from redis"}
+    ).decode()
+    assert _json(CLIENT.get("/users/red", headers=headers))["name"] == "from redis"
+
+    # a write invalidates the Redis entry
+    CLIENT.put("/users/red", data=_dump({"name": "new"}),
+               content_type="application/json", headers=headers)
+    assert "user:red" not in stub.store
+
+
+def test_profile_cache_redis_errors_fall_back_to_db(monkeypatch):
+    users_app = sys.modules[app.import_name]
+    monkeypatch.setattr(users_app, "_redis", _StubRedis(fail=True))
+    headers = _register_profile_user(CLIENT)
+
+    resp = CLIENT.get("/users/red", headers=headers)
+    assert resp.status_code == 200
+    assert _json(resp)["username"] == "red"
+
+    resp = CLIENT.put("/users/red", data=_dump({"name": "new"}),
+                      content_type="application/json", headers=headers)
+    assert resp.status_code == 200
+    assert _json(CLIENT.get("/users/red", headers=headers))["name"] == "new"
@@ -0,0 +1,14 @@
+# users_service/wsgi.py
+"""WSGI entry point for running the users service under gunicorn.
+
+    gunicorn -k gthread -w 2 --threads 8 -b 0.0.0.0:5001 wsgi:application
+
+threaded workers rather than gevent: the sqlite3 and argon2 calls are
+blocking C calls that never yield to an event loop, and each worker thread
+keeps its own SQLite connection (see :func:`database.get_db_connection`).
+"""
+from app import app, make_users_table_if_missing
+
+make_users_table_if_missing()
+
+application = app